@@ -0,0 +1,338 @@
+#!/usr/local/bin/python3
+
+__author__ = "Achim Stein"
+__version__ = "1.7 for CMLF 2024"
+__email__ = "achim.stein@ling.uni-stuttgart.de"
+__status__ = "18.4.24"
+__license__ = "GPL"
+
+import sys, os, json, time, re
+import importlib.util, subprocess
+import argparse, random, resource, tempfile, shutil, platform, datetime
+from contextlib import redirect_stdout
+
+# benchmark for ud-coding.py: times each phase of coding a synthetic CoNLL-U corpus
+
+# synthetic corpus: verbs and their dependents
+#   (deprel, upos, xpos, [(form, lemma)], child) with child = (deprel, upos, xpos, [(form, lemma)]) or None
+verbXpos = ['VERcjg', 'VERcjg', 'VERinf', 'VERppe']
+verbWords = [('dit', 'dire'), ('voit', 'voir'), ('fait', 'faire'), ('aller', 'aller'), ('venu', 'venir'), ('donne', 'donner'), ('prent', 'prendre')]
+clauseRels = ['xcomp', 'ccomp', 'advcl', 'acl', 'conj']
+clauseMarks = {
+    'xcomp': ('mark', 'ADP', 'PRE', [('de', 'de'), ('à', 'à')]),
+    'ccomp': ('mark', 'SCONJ', 'CONsub', [('que', 'que'), ('qu\'', 'que')]),
+    }
+caseChild = ('case', 'ADP', 'PRE', [('à', 'à'), ('de', 'de'), ('par', 'par'), ('au', 'à.le')])
+dependents = [
+    ('nsubj', 'PRON', 'PROper', [('il', 'il'), ('elle', 'elle'), ('on', 'on')], None),
+    ('nsubj', 'PRON', 'PROrel', [('qui', 'qui'), ('lequel', 'lequel')], None),
+    ('nsubj', 'NOUN', 'NOMcom', [('roi', 'roi'), ('dame', 'dame'), ('chevalier', 'chevalier')], None),
+    ('nsubj:pass', 'NOUN', 'NOMcom', [('cité', 'cité'), ('terre', 'terre')], None),
+    ('obj', 'PRON', 'PROper', [('le', 'le'), ('la', 'le'), ('me', 'me'), ('vos', 'vous')], None),
+    ('obj', 'NOUN', 'NOMcom', [('cheval', 'cheval'), ('espee', 'espee')], None),
+    ('iobj', 'PRON', 'PROper', [('li', 'lui'), ('lor', 'leur'), ('me', 'me')], None),
+    ('obl:mod', 'NOUN', 'NOMcom', [('bois', 'bois'), ('chastel', 'chastel')], caseChild),
+    ('obl:arg', 'PRON', 'PROper', [('lui', 'lui'), ('ce', 'ce')], caseChild),
+    ('obl:agent', 'NOUN', 'NOMcom', [('roi', 'roi')], caseChild),
+    ('obl', 'NOUN', 'NOMpro', [('Paris', 'Paris')], caseChild),
+    ('aux:tense', 'AUX', 'VERcjg', [('a', 'avoir'), ('est', 'être')], None),
+    ('aux:pass', 'AUX', 'VERcjg', [('est', 'être'), ('fu', 'être')], None),
+    ('expl:pv', 'PRON', 'PROper', [('se', 'se'), ('s\'', 'se')], None),
+    ('advmod', 'ADV', 'ADVgen', [('bien', 'bien'), ('puis', 'puis')], None),
+    ]
+
+def generateSentence (nrTokens, verbDensity):
+    # one random dependency tree with nrTokens tokens, about nrTokens*verbDensity of them verbs
+    #   returns a list of (form, lemma, upos, xpos, head, deprel) in linear order, head = position (0 = root)
+    nrVerbs = max(1, min(nrTokens, round(nrTokens * verbDensity)))
+    nodes = []  # (form, lemma, upos, xpos, head index or -1, deprel)
+    for v in range(nrVerbs):
+        form, lemma = random.choice(verbWords)
+        if v == 0:
+            nodes.append((form, lemma, 'VERB', random.choice(verbXpos), -1, 'root'))
+            continue
+        rel = random.choice(clauseRels)
+        nodes.append((form, lemma, 'VERB', random.choice(verbXpos), random.randrange(v), rel))
+        if rel in clauseMarks and len(nodes) < nrTokens:
+            deprel, upos, xpos, words = clauseMarks[rel]
+            nodes.append(random.choice(words) + (upos, xpos, len(nodes) - 1, deprel))
+    while len(nodes) < nrTokens:
+        deprel, upos, xpos, words, child = random.choice(dependents)
+        nodes.append(random.choice(words) + (upos, xpos, random.randrange(nrVerbs), deprel))
+        if child is not None and len(nodes) < nrTokens:
+            cDeprel, cUpos, cXpos, cWords = child
+            nodes.append(random.choice(cWords) + (cUpos, cXpos, len(nodes) - 1, cDeprel))
+    # random word order
+    order = list(range(len(nodes)))
+    random.shuffle(order)
+    position = {node: pos + 1 for pos, node in enumerate(order)}
+    return([(nodes[n][0], nodes[n][1], nodes[n][2], nodes[n][3], position[nodes[n][4]] if nodes[n][4] >= 0 else 0, nodes[n][5]) for n in order])
+
+def generateCorpus (fileName, nrSentences, tokens, verbDensity, seed):
+    # write a synthetic CoNLL-U corpus, sentence lengths vary around tokens (+/- 50%)
+    #   returns the number of tokens
+    random.seed(seed)
+    nrTokens = 0
+    with open(fileName, 'w') as out:
+        for s in range(1, nrSentences + 1):
+            length = max(1, round(tokens * random.uniform(0.5, 1.5)))
+            sentence = generateSentence(length, verbDensity)
+            nrTokens += len(sentence)
+            out.write(f"# sent_id = {s}\n# text_id = bench\n# text = {' '.join(w[0] for w in sentence)}\n")
+            for nr, (form, lemma, upos, xpos, head, deprel) in enumerate(sentence, 1):
+                out.write('\t'.join([str(nr), form, lemma, upos, xpos, '_', str(head), deprel, '_', '_']) + '\n')
+            out.write('\n')
+    return(nrTokens)
+
+def loadCoder (path):
+    # import ud-coding.py as a module (the file name is not a valid module name)
+    spec = importlib.util.spec_from_file_location('udcoding', path)
+    ud = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(ud)
+    return(ud)
+
+def peakMemory ():
+    # peak resident set size of this process in MB (ru_maxrss: KB on Linux, bytes on macOS)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return(round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1))
+
+def benchRun (ud, requestDict, corpusFile, quiet):
+    # code corpusFile once, following the phases of ud-coding.py (see codeFile and codeChunk)
+    #   returns phase -> seconds and the number of matches
+    phases = {}
+    sink = open(os.devnull, 'w') if quiet else sys.stdout
+    def phase (name, function):
+        start = time.perf_counter()
+        with redirect_stdout(sink):
+            result = function()
+        phases[name] = round(time.perf_counter() - start, 4)
+        return(result)
+
+    ud.codingAtt = []
+    def parseCorpus ():
+        sentences = None
+        if ud.args.splice:   # the byte offsets of the sentences are recorded while reading
+            with open(corpusFile, 'rb') as input:
+                data, sentences = next(ud.readSpliceChunks(input, 0))
+        else:
+            with open(corpusFile, 'r') as input:
+                data = input.read()
+        udCorpus = ud.Corpus(data)
+        shards = ud.splitShards(data, ud.args.workers) if ud.args.workers > 1 else None
+        return(udCorpus, shards, ud.newDraft(udCorpus, data), sentences)
+    udCorpus, shards, ud.wholeCorpus, sentences = phase('parse', parseCorpus)
+
+    def checkIDs ():
+        draft, corrected = ud.checkIDs(ud.wholeCorpus)
+        udCorpus.clean()
+        return(draft, ud.draftCorpus(draft))
+    ud.wholeCorpus, udCorpus = phase('check_ids', checkIDs)
+
+    codedCorpus = phase('process_rules', lambda: ud.processRules(udCorpus, requestDict, shards))
+    sortedKeys = sorted(codedCorpus.keys(), key=ud.sentKey)
+    matches = sum(len(coding['items']) for codings in ud.graphCodings.values() for coding in codings.values())
+
+    def writeConll ():
+        if sentences is not None:   # option --splice
+            spliced = ud.spliceChunk(sentences, codedCorpus)
+            with open(corpusFile, 'rb') as source, open('bench.coded.conllu', 'wb') as out:
+                ud.writeSplice(out, source, spliced)
+                shutil.copyfileobj(source, out)
+            with open(corpusFile, 'rb') as source:
+                return(ud.spliceText(source, spliced))
+        codedCONLLU = [codedCorpus[key].to_conll() for key in sortedKeys]
+        with open('bench.coded.conllu', 'w') as out:
+            for conll in codedCONLLU:
+                out.write(conll + '\n')
+        return(codedCONLLU)
+    codedCONLLU = phase('write_conllu', writeConll)
+
+    def writeHTML ():
+        out, htmlFile = ud.openHTML('bench.coded.conllu')
+        ud.writeHTML(out, codedCONLLU)
+        out.write(ud.htmlFoot + '\n')
+        out.close()
+    phase('html', writeHTML)
+
+    def writeTable ():
+        table = ud.openTable('bench.csv')
+        ud.writeTable(table, [codedCorpus[key] for key in sortedKeys])
+        ud.closeTable(table)
+    phase('table', writeTable)
+    if quiet:
+        sink.close()
+    return(phases, matches)
+
+def startupTimes (coder, requestFile, repeat):
+    # option --startup: wall time of coding a one-sentence corpus with ud-coding.py and ud-code.py (median of repeat runs)
+    #   and the cumulative import time (ms) of the modules imported by ud-code.py (python -X importtime, top-level modules)
+    generateCorpus('startup.conllu', 1, 12, 0.2, 1)
+    startup = {'seconds': {}, 'imports_ms': {}}
+    for script in ['ud-coding.py', 'ud-code.py']:
+        command = [sys.executable, os.path.join(os.path.dirname(coder), script), '-r', requestFile, 'startup.conllu', 'startup.coded.conllu']
+        times = []
+        for r in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            times.append(time.perf_counter() - start)
+        startup['seconds'][script] = round(sorted(times)[len(times) // 2], 4)
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + command[1:], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    for line in result.stderr.splitlines():
+        m = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\S.*)$', line)   # nested modules are indented
+        if m:
+            startup['imports_ms'][m.group(2)] = round(int(m.group(1)) / 1000, 1)
+    startup['imports_ms'] = dict(sorted(startup['imports_ms'].items(), key=lambda x: -x[1])[:10])
+    print(f"------- startup (median of {repeat} runs)", file=sys.stderr)
+    for script, seconds in startup['seconds'].items():
+        print(f"  {script:<14} {seconds:>9.3f} s", file=sys.stderr)
+    print(f"  imports (ms): {', '.join(f'{name} {ms}' for name, ms in startup['imports_ms'].items())}", file=sys.stderr)
+    return(startup)
+
+def compareResults (old, new):
+    # print the phase times of two result files side by side (runs with the same number of sentences)
+    oldRuns = {run['sentences']: run for run in old['runs']}
+    print(f"\nComparison with {old.get('label', '')} ({old.get('date', '')}): old / new seconds (ratio new/old)")
+    if 'startup' in old and 'startup' in new:
+        print("  startup")
+        for script, newTime in new['startup']['seconds'].items():
+            oldTime = old['startup']['seconds'].get(script)
+            if oldTime is not None:
+                ratio = f"{newTime / oldTime:.2f}" if oldTime > 0 else '-'
+                print(f"    {script:<14} {oldTime:>9.3f} {newTime:>9.3f}  ({ratio})")
+    for run in new['runs']:
+        if run['sentences'] not in oldRuns:
+            continue
+        oldRun = oldRuns[run['sentences']]
+        print(f"  {run['sentences']} sentences")
+        for name in list(run['phases']) + ['total']:
+            newTime = run['total'] if name == 'total' else run['phases'][name]
+            oldTime = oldRun['total'] if name == 'total' else oldRun['phases'].get(name)
+            if oldTime is None:
+                continue
+            ratio = f"{newTime / oldTime:.2f}" if oldTime > 0 else '-'
+            print(f"    {name:<14} {oldTime:>9.3f} {newTime:>9.3f}  ({ratio})")
+
+def main (benchArgs):
+    coder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ud-coding.py')
+    ud = loadCoder(coder)
+    ud.importGrew()
+    requestFile = os.path.abspath(benchArgs.request)
+    # options of ud-coding.py: given after --, all output phases are enabled
+    ud.args = ud.argumentParser().parse_args(benchArgs.coding_options + ['-C', '-H', '-t', 'bench.csv', '-r', requestFile, 'bench.conllu', 'bench.coded.conllu'])
+    ud.args.file_name = ud.args.file_name[0]
+    if ud.args.workers > 1:   # spawned workers cannot import the module loaded from ud-coding.py
+        sys.exit("ERROR: --workers is not supported in the benchmark")
+
+    workDir = tempfile.mkdtemp(prefix='ud-bench-')
+    oldDir = os.getcwd()
+    os.chdir(workDir)
+    results = {
+        'label': benchArgs.label,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': {'tokens': benchArgs.tokens, 'verb_density': benchArgs.verb_density, 'seed': benchArgs.seed,
+                    'repeat': benchArgs.repeat, 'request': benchArgs.request, 'coding_options': benchArgs.coding_options},
+        'runs': [],
+        }
+    try:
+        if benchArgs.startup > 0:
+            results['startup'] = startupTimes(coder, requestFile, benchArgs.startup)
+        start = time.perf_counter()
+        with redirect_stdout(open(os.devnull, 'w') if benchArgs.quiet else sys.stdout):
+            patterns, without, requestDict = ud.readRequests()
+        results['read_requests'] = round(time.perf_counter() - start, 4)
+        for nrSentences in sorted(benchArgs.sentences):
+            print(f"------- {nrSentences} sentences", file=sys.stderr)
+            nrTokens = generateCorpus('bench.conllu', nrSentences, benchArgs.tokens, benchArgs.verb_density, benchArgs.seed)
+            best = None
+            for r in range(benchArgs.repeat):   # keep the fastest run
+                phases, matches = benchRun(ud, requestDict, 'bench.conllu', benchArgs.quiet)
+                if best is None or sum(phases.values()) < sum(best.values()):
+                    best = phases
+            total = round(sum(best.values()), 4)
+            run = {
+                'sentences': nrSentences,
+                'tokens': nrTokens,
+                'matches': matches,
+                'phases': best,
+                'total': total,
+                'sentences_per_s': round(nrSentences / total, 1) if total > 0 else None,
+                'matches_per_s': round(matches / best['process_rules'], 1) if best['process_rules'] > 0 else None,
+                'peak_rss_mb': peakMemory(),
+                }
+            results['runs'].append(run)
+            for name, seconds in best.items():
+                print(f"  {name:<14} {seconds:>9.3f} s", file=sys.stderr)
+            print(f"  {'total':<14} {total:>9.3f} s   {run['sentences_per_s']} sentences/s, {run['matches_per_s']} matches/s, peak RSS {run['peak_rss_mb']} MB", file=sys.stderr)
+    finally:
+        if ud.searchPool is not None:
+            ud.searchPool.terminate()
+        os.chdir(oldDir)
+        if benchArgs.keep:
+            print(f"Output files kept in {workDir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    if benchArgs.output != '':
+        with open(benchArgs.output, 'w') as out:
+            json.dump(results, out, indent=2)
+        print(f"Results written to {benchArgs.output}", file=sys.stderr)
+    if benchArgs.compare != '':
+        with open(benchArgs.compare, 'r') as input:
+            compareResults(json.load(input), results)
+
+#-------------------------------------------------------
+# parse arguments
+#-------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+       description='''
+Benchmark for ud-coding.py: codes synthetic CoNLL-U corpora and times each phase
+(parse, check_ids, process_rules, write_conllu, html, table).
+Options for ud-coding.py can be given after --, e.g.:  ud-bench.py -s 1000 10000 -o new.json -- --engine index -f
+
+''', formatter_class = argparse.RawTextHelpFormatter   # allows triple quoting for multiple-line text
+       )
+    parser.add_argument(
+       '-s', '--sentences', default = [1000], type = int, nargs = '+',
+       help='corpus sizes in sentences (default 1000)')
+    parser.add_argument(
+       '--tokens', default = 12, type = int,
+       help='average number of tokens per sentence (default 12)')
+    parser.add_argument(
+       '--verb_density', default = 0.2, type = float,
+       help='proportion of verbs among the tokens (default 0.2)')
+    parser.add_argument(
+       '--seed', default = 1, type = int,
+       help='random seed of the corpus generator (default 1)')
+    parser.add_argument(
+       '-r', '--request', default = "requests.tsv", type = str,
+       help='grew requests (default requests.tsv)')
+    parser.add_argument(
+       '--repeat', default = 1, type = int,
+       help='code each corpus N times and keep the fastest run (default 1)')
+    parser.add_argument(
+       '--startup', default = 0, type = int,
+       help='also time the startup: code a one-sentence corpus N times with ud-coding.py and ud-code.py (median)\n  and report the import times of the modules')
+    parser.add_argument(
+       '-o', '--output', default = "", type = str,
+       help='write the results to this JSON file')
+    parser.add_argument(
+       '--compare', default = "", type = str,
+       help='compare the results with this JSON file of an earlier run')
+    parser.add_argument(
+       '--label', default = "", type = str,
+       help='label of this run in the JSON results (e.g. the version)')
+    parser.add_argument(
+       '-q', '--quiet', action='store_true',
+       help='hide the progress messages of ud-coding.py')
+    parser.add_argument(
+       '--keep', action='store_true',
+       help='keep the temporary directory with the corpus and the output files')
+    parser.add_argument('coding_options', nargs = argparse.REMAINDER,
+       help='options for ud-coding.py, after --')
+    benchArgs = parser.parse_args()
+    if benchArgs.coding_options[:1] == ['--']:
+        benchArgs.coding_options = benchArgs.coding_options[1:]
+    main(benchArgs)
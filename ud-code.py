@@ -0,0 +1,23 @@
+#!/usr/local/bin/python3
+
+__author__ = "Achim Stein"
+__version__ = "1.7 for CMLF 2024"
+__email__ = "achim.stein@ling.uni-stuttgart.de"
+__status__ = "18.4.24"
+__license__ = "GPL"
+
+import sys, os
+import importlib.util
+
+# lean entry point of ud-coding.py for coding only (same options, except -c)
+#   ud-coding.py is imported as a module: its bytecode is cached in __pycache__, not compiled on every run
+#   pandas is never imported, grewpy and conllu only when needed (see importGrew)
+
+# the module is registered in sys.modules: spawned workers (--batch, --workers) import this script and find it
+spec = importlib.util.spec_from_file_location('udcoding', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ud-coding.py'))
+ud = importlib.util.module_from_spec(spec)
+sys.modules['udcoding'] = ud
+spec.loader.exec_module(ud)
+
+if __name__ == "__main__":
+    ud.run(codingOnly=True)
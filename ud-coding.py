@@ -6,23 +6,47 @@ __email__ = "achim.stein@ling.uni-stuttgart.de"
 __status__ = "18.4.24"
 __license__ = "GPL"
 
-import sys, os, json, io
-from io import StringIO
+import sys, os, io, json, glob, time, resource
+import tempfile, shutil
+import importlib.util
+import multiprocessing, itertools
+import threading, queue
+import hashlib, sqlite3
+from array import array
+import mmap, marshal
 import argparse, re
 import csv
-import pandas as pd
 import datetime
 from collections import defaultdict   # init dicts with value type
-from grewpy import Graph, CorpusDraft, Request, Corpus, request_counter
-from grewpy import Corpus, GRSDraft, Rule, Commands, GRS, set_config
-from nltk.grammar import DependencyGrammar
-from nltk.parse import DependencyGraph, ProjectiveDependencyParser, NonprojectiveDependencyParser
-from conllu import parse, parse_incr, parse_tree
+# heavy dependencies are imported on the code paths that need them:
+#   grewpy for coding (importGrew), pandas for option -c (main), conllu for option -H (writeHTML, writePages)
+Graph = CorpusDraft = Request = Corpus = None  # grewpy, see importGrew
+pd = None  # pandas
 
 
 # global vars
 codingAtt = []  # collect coding attributes in this list
-wholeCorpus = {} # a grewpy CorpusDraft object
+wholeCorpus = {} # a grewpy CorpusDraft object (CompactCorpus with --compact)
+workerRequests = {}  # option --batch: requestDict in pool workers
+graphCodings = {}  # codings of the current chunk: sent_id -> node -> coding (see addCoding)
+searchPool = None  # option --workers: process pool for parallel search
+compactBatch = 1000  # option --compact: sentences parsed and converted together (see CompactCorpus)
+pruneRatio = 0.5  # option --first_rule: search a subset of the corpus if it has at most this share of the graphs
+engineRules = {}  # options --engine index, --first_rule: compiled requests with key att=val (None = search with grew)
+prefilterRules = {}  # literal constraints of the requests with key att=val (see prefilterRule)
+ruleHashes = {}  # option --cache: hash of pattern and without with key att=val
+matchCache = None  # option --cache: SQLite connection
+profile = None  # option --profile: phase and rule timings (see newProfile)
+profileLock = threading.Lock()  # option --profile: phases are also timed in the output writer threads
+writeBuffer = 1 << 20  # buffer size of the output files (bytes)
+writeQueueSize = 2  # option --async_output: jobs (chunks) waiting for a writer thread
+compressionSuffixes = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma', '.zst': 'zstd'}  # compressed files (see openFile)
+gzipLevel = 6  # compression level of .gz output (level 9 is much slower for little gain)
+htmlPages = {}  # option --html_page_size: sent_id -> HTML page of the current file (for the table URLs)
+manifestOptions = ['first_rule', 'keep_target_node_info', 'check_ids', 'html', 'html_file', 'html_page_size',
+                   'chunk_size', 'splice', 'table_format', 'table_empty_string']  # option --manifest: options that change the outputs
+manifestInterval = 10  # option --manifest: seconds between checkpoints (the manifest is also written at the end)
+manifestSaved = 0.0  # option --manifest: time of the last checkpoint
 
 # global vars for HTML corpus on server
 # global variables
@@ -72,15 +96,115 @@ French lemmatization using RNN (Schmid 2019; LMU München) and BFM training data
 ''' % (os.path.basename(__file__), __version__, str(datetime.date.today()))
 corpusName = 'FTPUB1'  # default
 htmlDir = "ft"
+# option --html_page_size: search page for the JSON indexes of the paginated files (search.html?index=<file>.index.json)
+htmlSearch = '''<!DOCTYPE html>
+<html>
+  <meta http-equiv="Content-type" content="text/html; charset=utf-8" />
+  <head>
+    <title>FTPUB: search</title>
+    <style>
+      body { font-family: sans-serif; }
+      .hits a { font-family: monospace; }
+    </style>
+  </head>
+  <body>
+    <h3 id="title">Search</h3>
+    <form id="form">
+      <input id="query" size="40" placeholder="lemma or coding, e.g. dire  subj=pro  clause=main"/>
+      <input type="submit" value="Search"/>
+    </form>
+    <p id="count"></p>
+    <div class="hits" id="hits"></div>
+    <p><a href="index.html">List of files</a></p>
+    <script>
+      // the terms of a query are combined with AND: lemmas and att=val codings
+      var index = null;
+      var file = new URLSearchParams(window.location.search).get('index');
+      function search(event) {
+        if (event) event.preventDefault();
+        if (index === null) return;
+        var hits = null;
+        document.getElementById('query').value.trim().split(/\\s+/).filter(Boolean).forEach(function(term) {
+          var found = (term.indexOf('=') > 0 ? index.codings[term] : index.lemmas[term]) || [];
+          hits = hits === null ? found : hits.filter(function(id) { return found.indexOf(id) >= 0; });
+        });
+        hits = hits || [];
+        document.getElementById('count').textContent = hits.length + ' sentence(s)' + (hits.length > 500 ? ', showing 500' : '');
+        document.getElementById('hits').innerHTML = hits.slice(0, 500).map(function(id) {
+          var page = index.pages[index.sentences[id] - 1];
+          return '<a href="' + page + '#' + encodeURIComponent(id) + '">' + id + '</a>';
+        }).join('<br/>\\n');
+      }
+      document.getElementById('form').addEventListener('submit', search);
+      if (file) {
+        fetch(file).then(function(response) { return response.json(); }).then(function(data) {
+          index = data;
+          document.getElementById('title').textContent = 'Search: ' + data.title + ' (' + Object.keys(data.sentences).length + ' sentences, ' + data.pages.length + ' pages)';
+        });
+      }
+    </script>
+  </body>
+</html>
+'''
 
 
 # -------------------------------------------------------
 # functions
 # -------------------------------------------------------
+def importGrew ():
+    # import the grewpy classes (once per process, also in spawned workers)
+    global Graph, CorpusDraft, Request, Corpus
+    if Corpus is None:
+        from grewpy import Graph, CorpusDraft, Request, Corpus
+
+def compressionSuffix (fileName):
+    # the compression suffix of fileName ('' if not compressed)
+    suffix = os.path.splitext(fileName)[1].lower()
+    return(suffix if suffix in compressionSuffixes else '')
+
+def plainName (fileName):
+    # fileName without compression suffix
+    return(fileName[:len(fileName) - len(compressionSuffix(fileName))])
+
+def openFile (fileName, mode='r', **options):
+    # open() for plain and compressed files, the codec is chosen from the suffix (see compressionSuffixes)
+    #   the data are (de)compressed while they are read or written: a compressed file is never expanded on disk
+    #   options: as for open() (buffering is left to the codec)
+    suffix = compressionSuffix(fileName)
+    if suffix == '':
+        return(open(fileName, mode, **options))
+    options.pop('buffering', None)
+    if 'b' not in mode and 't' not in mode:
+        mode += 't'
+    codec = compressionSuffixes[suffix]
+    if codec == 'gzip':
+        import gzip
+        return(gzip.open(fileName, mode, compresslevel=gzipLevel, **options))
+    if codec == 'bz2':
+        import bz2
+        return(bz2.open(fileName, mode, **options))
+    if codec == 'lzma':
+        import lzma
+        return(lzma.open(fileName, mode, **options))
+    # zstd: in the standard library since Python 3.14, otherwise the zstandard package
+    try:
+        from compression import zstd
+    except ImportError:
+        try:
+            import zstandard as zstd
+        except ImportError:
+            sys.exit(f"ERROR: {fileName}: zstd compression requires Python 3.14 or zstandard (pip install zstandard)")
+    file = zstd.open(fileName, mode, **options)
+    if mode == 'rb' and zstd.__name__ == 'zstandard':   # its reader has no readline(): lines are read through a buffer
+        file = io.BufferedReader(file, buffer_size=writeBuffer)
+    return(file)
+
 def readRequests():
     # parse the TSV file containing GREW requests
     print(f"Reading grew requests from file {args.request}")
     requests = open(args.request, 'r')
+    global ruleHashes
+    ruleHashes = {}
     patterns = {}  # store requests in this dictionary
     without = {}  # store negative requests in this dictionary
     requestDict = {}  # store requests with key att=val in this dictionary
@@ -109,12 +233,1053 @@ def readRequests():
         if key in without.keys():
             objRequest.append('without', without[key])
         requestDict[key] = objRequest
+        # rule hash for the match cache (option --cache)
+        ruleHashes[key] = hashlib.sha1((patterns[key] + '\t' + without.get(key, '')).encode('utf-8')).hexdigest()
+    # option --engine index: compile the requests for the index engine
+    #   option --first_rule: the compiled requests give the candidates for V (see ruleCandidates)
+    if args.engine == 'index' or args.first_rule:
+        global engineRules
+        engineRules = {key: compileRequest(patterns[key], without.get(key), args.engine == 'index') for key in patterns.keys()}
+    if args.engine == 'index':
+        print(f"  {len([key for key in engineRules if engineRules[key] is not None])} request(s) compiled for the index engine.")
+    # prefilter for grew searches: literal constraints of the patterns
+    global prefilterRules
+    prefilterRules = {key: prefilterRule(patterns[key]) for key in patterns.keys()}
     print()
     return(patterns, without, requestDict)
 
-def processRules (udCorpus, requestDict):
+# -------------------------------------------------------
+# rule evaluation engine (option --engine index)
+# -------------------------------------------------------
+"""
+The index engine evaluates the requests in a single pass over the graphs of the CorpusDraft,
+instead of one udCorpus.search() for each rule:
+  - for each graph, nodes are indexed by upos/xpos/lemma and edges by deprel (indexGraph)
+  - node constraints shared by many rules (e.g. the verb constraint of V) are evaluated once per graph
+  - each rule then only checks its own constraints, starting from the candidates for V
+It covers the grew syntax used in requests.tsv:
+  node clauses     V [upos="VERB", !xpos]|[xpos=re"V.*"]   (=, <>, re"...", a|b, !feat, feat)
+  edge clauses     V -[nsubj]-> C, V -[re"obj.*"]-> C, V -[^obl:arg|obl:mod]-> C, V -> C
+Like grew, matching is injective, regular expressions must match the whole value and
+feat<>value requires the feature to be defined.
+Requests with other grew syntax (named edges, order, feature comparisons...) are searched with grew.
+"""
+def splitOutside (text, sep):
+    # split text at the character sep, except within double quotes or brackets
+    parts = []
+    current = ''
+    quoted = False
+    depth = 0
+    escaped = False
+    for char in text:
+        if escaped:
+            escaped = False
+        elif char == '\\' and quoted:
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif not quoted and char == '[':
+            depth += 1
+        elif not quoted and char == ']':
+            depth -= 1
+        elif not quoted and depth == 0 and char == sep:
+            parts.append(current)
+            current = ''
+            continue
+        current += char
+    if quoted or depth != 0:
+        raise ValueError(f"unbalanced quotes or brackets: {text}")
+    parts.append(current)
+    return(parts)
+
+def unquote (value):
+    # remove the double quotes of a grew string
+    value = value.strip()
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return(re.sub(r'\\(.)', r'\1', value[1:-1]))
+    if re.search(r'[\s"=<>!\[\]]', value) or value == '':
+        raise ValueError(f"unsupported value: {value}")
+    return(value)
+
+def compileValue (value):
+    # grew value: re"regex" or alternatives a|"b" -> compiled regex or set of strings
+    value = value.strip()
+    if value.startswith('re"'):
+        return(re.compile(unquote(value[2:])))
+    return(frozenset(unquote(v) for v in splitOutside(value, '|')))
+
+def valueMatches (value, compiled):
+    if isinstance(compiled, frozenset):
+        return(value in compiled)
+    return(compiled.fullmatch(value) is not None)
+
+def compileNodeClause (text):
+    # [f=v, !g]|[h=re"..."] -> list of alternatives, each a list of (feature, operator, value)
+    alternatives = []
+    for alternative in splitOutside(text, '|'):
+        alternative = alternative.strip()
+        if not (alternative.startswith('[') and alternative.endswith(']')):
+            raise ValueError(f"unsupported node clause: {text}")
+        tests = []
+        for item in splitOutside(alternative[1:-1], ','):
+            item = item.strip()
+            if item == '':
+                continue
+            m = re.match(r'^([\w:.-]+)\s*(<>|=)\s*(.*)$', item)
+            if m:
+                tests.append((m.group(1), m.group(2), compileValue(m.group(3))))
+            elif re.match(r'^!\s*[\w:.-]+$', item):
+                tests.append((item[1:].strip(), '!', None))
+            elif re.match(r'^[\w:.-]+$', item):
+                tests.append((item, '', None))
+            else:
+                raise ValueError(f"unsupported feature constraint: {item}")
+        alternatives.append(tests)
+    return(alternatives)
+
+def compileEdgeLabel (text):
+    # edge label test: None (any label), ('in'|'not', set of labels) or ('re', regex)
+    if text is None:
+        return(None)
+    text = text.strip()
+    if text.startswith('re"'):
+        return(('re', re.compile(unquote(text[2:]))))
+    if text.startswith('^'):
+        return(('not', frozenset(unquote(v) for v in splitOutside(text[1:], '|'))))
+    return(('in', frozenset(unquote(v) for v in splitOutside(text, '|'))))
+
+def labelMatches (label, test):
+    if test is None:
+        return(True)
+    if test[0] == 'in':
+        return(label in test[1])
+    if test[0] == 'not':
+        return(not label in test[1])
+    return(test[1].fullmatch(label) is not None)
+
+def compileClauses (text, nodes, edges):
+    # add the node and edge clauses of a grew pattern to nodes (name -> [clauses]) and edges [(src, test, tar)]
+    for clause in splitOutside(text, ';'):
+        clause = clause.strip()
+        if clause == '':
+            continue
+        m = re.match(r'^(\w+)\s*(\[.*\])$', clause, re.S)
+        if m:
+            nodes.setdefault(m.group(1), []).append((re.sub(r'\s+', '', m.group(2)), compileNodeClause(m.group(2))))
+            continue
+        m = re.match(r'^(\w+)\s*(?:-\[(.*)\]->|->)\s*(\w+)$', clause, re.S)
+        if m:
+            edges.append((m.group(1), compileEdgeLabel(m.group(2)), m.group(3)))
+            nodes.setdefault(m.group(1), [])
+            nodes.setdefault(m.group(3), [])
+            continue
+        raise ValueError(f"unsupported clause: {clause}")
+
+def planMatch (nodes, edges, bound):
+    # order in which the nodes that are not yet bound are matched: V first, then along the edges
+    #   each step: (node, clauses, anchor edge to a known node or None, edges to check, deprels required)
+    steps = []
+    known = set(bound)
+    todo = [n for n in nodes if not n in known]
+    while todo:
+        linked = [n for n in todo if any((s in known and t == n) or (t in known and s == n) for s, l, t in edges)]
+        if linked:
+            node = linked[0]
+        elif 'V' in todo:
+            node = 'V'
+        else:
+            node = todo[0]
+        todo.remove(node)
+        anchor = None
+        checks = []
+        required = []
+        for s, l, t in edges:
+            if (s == node and (t in known or t == node)) or (t == node and s in known):
+                if anchor is None and s != t:
+                    anchor = (s, l, t)
+                else:
+                    checks.append((s, l, t))
+            elif l is not None and l[0] == 'in' and (s == node or t == node):
+                required.append(('out' if s == node else 'in', l[1]))   # edge to a node matched later
+        steps.append((node, tuple(nodes[node]), anchor, checks, required))
+        known.add(node)
+    return(steps)
+
+def compileRequest (pattern, withoutPattern=None, verbose=True):
+    # compile a request for the index engine, returns None if it uses unsupported grew syntax
+    #   vClauses, vEdges: the constraints of V in the pattern (see candidateNodes)
+    try:
+        nodes = {}
+        edges = []
+        compileClauses(pattern, nodes, edges)
+        rule = {'steps': planMatch(nodes, edges, []), 'without': [], 'names': list(nodes.keys()),
+                'vClauses': nodes.get('V'), 'vEdges': [(s, l, t) for s, l, t in edges if s != t and 'V' in (s, t)]}
+        if withoutPattern:
+            # without: new nodes are matched in steps, constraints on pattern nodes are checked directly
+            withoutNodes = {}
+            withoutEdges = []
+            compileClauses(withoutPattern, withoutNodes, withoutEdges)
+            newNodes = {n: withoutNodes[n] for n in withoutNodes if not n in nodes}
+            boundClauses = [(n, withoutNodes[n]) for n in withoutNodes if n in nodes and withoutNodes[n]]
+            boundEdges = [(s, l, t) for s, l, t in withoutEdges if s in nodes and t in nodes]
+            rule['without'].append((planMatch(newNodes, withoutEdges, list(nodes.keys())), boundClauses, boundEdges))
+    except (ValueError, re.error) as e:
+        if verbose:
+            print(f"  Index engine: request is searched with grew ({e})")
+        return(None)
+    return(rule)
+
+def edgeLabel (label):
+    # grew edge labels are strings or feature structures, e.g. {'1': 'nsubj', '2': 'pass'} for nsubj:pass
+    if isinstance(label, str):
+        return(label)
+    if set(label.keys()) <= {'1', '2', 'deep', 'type'}:
+        return(label.get('1', '') + ''.join(sep + label[key] for key, sep in [('2', ':'), ('deep', '@'), ('type', '/')] if key in label))
+    return(','.join(f"{key}={label[key]}" for key in sorted(label.keys())))
+
+def indexGraph (graph):
+    # match index for one graph: node features, edges by source/target/deprel, lazy feature index and clause cache
+    data = graph.json_data()
+    gIndex = {'feats': data['nodes'], 'out': defaultdict(list), 'in': defaultdict(list),
+              'deprel': defaultdict(list), 'byFeat': {}, 'cache': {}}
+    order = data.get('order') or list(data['nodes'].keys())
+    gIndex['order'] = [n for n in order if n in data['nodes']]
+    gIndex['position'] = {n: i for i, n in enumerate(gIndex['order'])}
+    for edge in data['edges']:
+        label = edgeLabel(edge['label'])
+        gIndex['out'][edge['src']].append((label, edge['tar']))
+        gIndex['in'][edge['tar']].append((label, edge['src']))
+        gIndex['deprel'][label].append((edge['src'], edge['tar']))
+    return(gIndex)
+
+def featureMatches (feats, tests):
+    for att, op, value in tests:
+        if op == '!':
+            if att in feats:
+                return(False)
+        elif not att in feats:
+            return(False)
+        elif op == '=' and not valueMatches(feats[att], value):
+            return(False)
+        elif op == '<>' and valueMatches(feats[att], value):
+            return(False)
+    return(True)
+
+def clauseNodes (gIndex, key, alternatives):
+    # set of nodes satisfying a node clause, computed once per graph (shared by all rules)
+    if key in gIndex['cache']:
+        return(gIndex['cache'][key])
+    feats = gIndex['feats']
+    found = set()
+    for tests in alternatives:
+        candidates = gIndex['order']
+        # use the feature index for upos, xpos and lemma values
+        for att, op, value in tests:
+            if op == '=' and isinstance(value, frozenset) and att in ('upos', 'xpos', 'lemma'):
+                if not att in gIndex['byFeat']:
+                    byValue = defaultdict(list)
+                    for n in gIndex['order']:
+                        if att in feats[n]:
+                            byValue[feats[n][att]].append(n)
+                    gIndex['byFeat'][att] = byValue
+                candidates = [n for v in value for n in gIndex['byFeat'][att].get(v, [])]
+                break
+        for n in candidates:
+            if not n in found and featureMatches(feats[n], tests):
+                found.add(n)
+    gIndex['cache'][key] = found
+    return(found)
+
+def stepCandidates (gIndex, step, assignment):
+    # candidate graph nodes for a step: neighbours of the anchor node, or nodes from the deprel/clause index
+    node, clauses, anchor, checks, required = step
+    if anchor is not None:
+        s, test, t = anchor
+        if s == node:
+            return([src for label, src in gIndex['in'][assignment[t]] if labelMatches(label, test)])
+        return([tar for label, tar in gIndex['out'][assignment[s]] if labelMatches(label, test)])
+    candidates = None
+    for direction, labels in required:
+        nodes = set(src if direction == 'out' else tar for label in labels for src, tar in gIndex['deprel'].get(label, []))
+        candidates = nodes if candidates is None else candidates & nodes
+    if clauses:
+        nodes = clauseNodes(gIndex, clauses[0][0], clauses[0][1])
+        candidates = nodes if candidates is None else candidates & nodes
+    if candidates is None:
+        return(gIndex['order'])
+    return([n for n in gIndex['order'] if n in candidates])
+
+def edgeExists (gIndex, src, test, tar):
+    return(any(t == tar and labelMatches(label, test) for label, t in gIndex['out'][src]))
+
+def matchSteps (gIndex, steps, assignment, used, depth=0, exclude=()):
+    # yield all injective extensions of assignment (node name -> graph node) for the remaining steps
+    #   exclude: graph nodes not to be matched by V (option --first_rule)
+    if depth == len(steps):
+        yield assignment
+        return
+    step = steps[depth]
+    node, clauses, anchor, checks, required = step
+    for n in stepCandidates(gIndex, step, assignment):
+        if n in used or (node == 'V' and n in exclude):
+            continue
+        if not all(n in clauseNodes(gIndex, key, alternatives) for key, alternatives in clauses):
+            continue
+        assignment[node] = n
+        if all(edgeExists(gIndex, assignment[s], test, assignment[t]) for s, test, t in checks):
+            used.add(n)
+            yield from matchSteps(gIndex, steps, assignment, used, depth + 1, exclude)
+            used.discard(n)
+        del assignment[node]
+
+def matchRequest (gIndex, rule, exclude=()):
+    # all matches of a compiled request in one graph (list of node dicts, like grew's 'matching' 'nodes')
+    #   exclude: graph nodes not to be matched by V
+    matches = []
+    for assignment in matchSteps(gIndex, rule['steps'], {}, set(), exclude=exclude):
+        rejected = False
+        for steps, boundClauses, boundEdges in rule['without']:
+            if not all(assignment[n] in clauseNodes(gIndex, key, alternatives) for n, clauses in boundClauses for key, alternatives in clauses):
+                continue
+            if not all(edgeExists(gIndex, assignment[s], test, assignment[t]) for s, test, t in boundEdges):
+                continue
+            if next(matchSteps(gIndex, steps, dict(assignment), set(assignment.values())), None) is not None:
+                rejected = True
+                break
+        if not rejected:
+            matches.append(dict(assignment))
+    # order matches by the graph positions of the pattern nodes, in the order they are declared
+    position = gIndex['position']
+    matches.sort(key=lambda nodes: [position.get(nodes[n], -1) for n in rule['names']])
+    return(matches)
+
+def searchIndex (requestDict, coded=None):
+    # option --engine index: evaluate the compiled requests in a single pass over the graphs of wholeCorpus
+    #   returns a dictionary att=val -> list of matches (format of udCorpus.search()) for the compiled requests
+    #   coded: option --first_rule, att -> sent_id -> nodes coded by the input (see codedNodes)
+    #     V is not matched on nodes already coded for the attribute by the input or by an earlier rule,
+    #     as long as all earlier rules of the attribute are evaluated here
+    rules = [(attVal, engineRules[attVal]) for attVal in requestDict.keys() if engineRules.get(attVal) is not None]
+    found = {attVal: [] for attVal, rule in rules}
+    seconds = {attVal: 0.0 for attVal, rule in rules}   # option --profile
+    pruned = {}   # attVal -> attribute, for the rules that can skip coded nodes
+    if coded is not None:
+        searchedWithGrew = set()
+        for attVal in requestDict.keys():
+            att = ruleAttribute(attVal)
+            if engineRules.get(attVal) is None:
+                searchedWithGrew.add(att)
+            elif not att in searchedWithGrew and 'V' in engineRules[attVal]['names']:
+                pruned[attVal] = att
+    for thisID in wholeCorpus.keys():
+        gIndex = indexGraph(wholeCorpus[thisID])
+        graphCoded = defaultdict(set)   # att -> nodes coded in this graph
+        for attVal, rule in rules:
+            if profile is not None:
+                start = time.perf_counter()
+            exclude = ()
+            if attVal in pruned:
+                exclude = graphCoded[pruned[attVal]]
+                exclude.update(coded.get(pruned[attVal], {}).get(thisID, ()))
+            for nodes in matchRequest(gIndex, rule, exclude):
+                found[attVal].append({'sent_id': thisID, 'matching': {'nodes': nodes, 'edges': {}}})
+                if attVal in pruned:
+                    exclude.add(nodes['V'])
+            if profile is not None:
+                seconds[attVal] += time.perf_counter() - start
+    for attVal, rule in rules:
+        profileRule(attVal, seconds[attVal], engine='index')
+    return(found)
+
+# -------------------------------------------------------
+# rule pruning (option --first_rule)
+# -------------------------------------------------------
+"""
+With --first_rule, addCoding() discards the matches of a rule on a verb node that is already coded
+for the attribute (by the input or by an earlier rule of the attribute, in file order).
+Such searches are avoided:
+  - the index engine does not match V on coded nodes (searchIndex)
+  - grew searches a rule only on the graphs where a candidate for V is not yet coded (pruneCorpus)
+The candidates for V are the nodes satisfying the node and edge constraints of V in the pattern (candidateNodes).
+Rules with unsupported grew syntax (see compileRequest) are searched on all graphs.
+"""
+def ruleAttribute (attVal):
+    # the attribute of a rule key att=val, as in addCoding
+    return(attVal.split('=')[0].replace(';', '_'))
+
+def codedNodes ():
+    # the nodes with an attribute in the coding string of the input: att -> sent_id -> set of nodes
+    coded = defaultdict(dict)
+    for thisID in wholeCorpus.keys():
+        for key, value in graphMeta(wholeCorpus[thisID]).items():
+            if key.startswith('coding_'):
+                for pair in value.split(';')[1:]:   # attributes after the first pair, as in addCoding
+                    coded[pair.split('=')[0]].setdefault(thisID, set()).add(key[len('coding_'):])
+    return(coded)
+
+def candidateNodes (gIndex, rule):
+    # the graph nodes that can be matched by V: node clauses of V and its edges to other nodes
+    nodes = set(gIndex['order'])
+    for key, alternatives in rule['vClauses']:
+        nodes &= clauseNodes(gIndex, key, alternatives)
+    for s, test, t in rule['vEdges']:
+        direction = 'out' if s == 'V' else 'in'
+        nodes = set(n for n in nodes if any(labelMatches(label, test) for label, other in gIndex[direction][n]))
+    return(nodes)
+
+def ruleCandidates (ruleKeys):
+    # the candidates for V of the compiled rules in ruleKeys, in a single pass over the graphs
+    #   returns att=val -> sent_id -> set of nodes (graphs without candidates are left out)
+    rules = [(attVal, engineRules[attVal]) for attVal in ruleKeys if engineRules.get(attVal) is not None and 'V' in engineRules[attVal]['names']]
+    candidates = {attVal: {} for attVal, rule in rules}
+    if not rules:
+        return(candidates)
+    for thisID in wholeCorpus.keys():
+        gIndex = indexGraph(wholeCorpus[thisID])
+        for attVal, rule in rules:
+            nodes = candidateNodes(gIndex, rule)
+            if nodes:
+                candidates[attVal][thisID] = nodes
+    return(candidates)
+
+def uncodedGraphs (candidates, coded):
+    # the graphs with candidates for V that are not coded yet: set of sent_ids
+    #   candidates: sent_id -> candidates for V, coded: sent_id -> nodes coded for the attribute of the rule
+    return(set(thisID for thisID, nodes in candidates.items() if not nodes <= coded.get(thisID, set())))
+
+def subCorpus (udCorpus, sentIDs):
+    # the corpus to be searched for a rule: udCorpus, a grew Corpus of the graphs in sentIDs, or None (no graph)
+    #   sentIDs: set of sent_ids (None = all graphs)
+    if sentIDs is None:
+        return(udCorpus)
+    if not sentIDs:
+        return(None)
+    if len(sentIDs) > len(udCorpus) * pruneRatio:   # building a smaller grew corpus does not pay off
+        return(udCorpus)
+    return(Corpus({thisID: wholeCorpus[thisID] for thisID in wholeCorpus.keys() if thisID in sentIDs}))
+
+# -------------------------------------------------------
+# prefilter (grew searches)
+# -------------------------------------------------------
+"""
+Option --prefilter: before a rule is searched with grew, the graphs that cannot match are left out.
+readRequests() pulls the literal constraints out of each pattern (prefilterRule), e.g.
+  P [xpos="PROrel"]                  some node has xpos PROrel
+  V -[iobj|obl:arg]-> C              some edge label is iobj or obl:arg
+  V [upos="VERB"]|[xpos="VERinf"]    some node has upos VERB or xpos VERinf
+An inverted index of the graphs (feature -> value -> sent_ids, edge label -> sent_ids) gives
+the candidate graphs of a rule (prefilterGraphs). Only literal values are used: regular expressions,
+negations (<>, !feat, ^label), without clauses and clauses with unsupported syntax add no constraint.
+Edges are indexed by their full label and by its relation (nsubj:pass also under nsubj),
+so that a graph stays a candidate whichever way grew matches subtypes.
+"""
+def prefilterRule (pattern):
+    # the literal constraints of a pattern: a list of requirements, all of which a graph must satisfy
+    #   requirement: list of alternatives, one of which must hold
+    #   alternative: list of (feature, value) that must hold for one node, feature None for an edge label
+    #   value: set of strings (see compileValue)
+    requirements = []
+    try:
+        clauses = splitOutside(pattern, ';')
+    except ValueError:
+        return(requirements)
+    for clause in clauses:
+        nodes = {}
+        edges = []
+        try:
+            compileClauses(clause, nodes, edges)
+        except (ValueError, re.error):
+            continue
+        for name in nodes.keys():
+            for key, alternatives in nodes[name]:
+                options = []
+                for tests in alternatives:
+                    literal = [(att, value) for att, op, value in tests if op == '=' and isinstance(value, frozenset)]
+                    if not literal:   # this alternative can match without literal values
+                        options = []
+                        break
+                    options.append(literal)
+                if options:
+                    requirements.append(options)
+        for src, test, tar in edges:
+            if test is not None and test[0] == 'in':
+                requirements.append([[(None, test[1])]])
+    return(requirements)
+
+def prefilterIndex (requirements):
+    # inverted index of wholeCorpus for the features used in requirements: feature -> value -> set of sent_ids
+    #   edge labels under the feature None
+    features = set(att for requirement in requirements for alternative in requirement for att, value in alternative)
+    index = {att: defaultdict(set) for att in features}
+    for thisID in wholeCorpus.keys():
+        data = wholeCorpus[thisID].json_data()
+        for feats in data['nodes'].values():
+            for att in features:
+                if att in feats:
+                    index[att][feats[att]].add(thisID)
+        if None in index:
+            for edge in data['edges']:
+                label = edgeLabel(edge['label'])
+                index[None][label].add(thisID)
+                relation = edge['label'].get('1') if isinstance(edge['label'], dict) else label.split(':')[0]
+                if relation is not None:
+                    index[None][relation].add(thisID)
+    return(index)
+
+def prefilterGraphs (index, requirements):
+    # the graphs satisfying the requirements of a rule: set of sent_ids
+    sentIDs = None
+    for requirement in requirements:
+        found = set()
+        for alternative in requirement:
+            graphs = None
+            for att, value in alternative:
+                postings = index[att]
+                values = [v for v in value if v in postings]
+                withValue = set().union(*[postings[v] for v in values])
+                graphs = withValue if graphs is None else graphs & withValue
+            found |= graphs
+        sentIDs = found if sentIDs is None else sentIDs & found
+        if not sentIDs:
+            break
+    return(sentIDs)
+
+# -------------------------------------------------------
+# parallel search (option --workers)
+# -------------------------------------------------------
+def splitShards (data, nrShards):
+    # split a CoNLL-U string into nrShards shards of consecutive sentences
+    #   returns a list of (CoNLL-U string, number of sentences)
+    blocks = [block for block in re.split(r'\n[ \t]*\n', data) if block.strip() != '']
+    size = -(-len(blocks) // nrShards)   # ceiling
+    shards = []
+    for start in range(0, len(blocks), max(size, 1)):
+        shards.append(('\n\n'.join(blocks[start:start+size]) + '\n\n', len(blocks[start:start+size])))
+    return(shards)
+
+def initSearchWorker (workerArgs, requestDict):
+    # initialize the globals of a search worker (spawned processes only import the script)
+    global args, workerRequests
+    args = workerArgs
+    workerRequests = requestDict
+    importGrew()
+
+def searchShard (task):
+    # search worker: apply some requests to a shard of the corpus
+    #   returns att=val -> list of (position of the graph in the shard, grew 'matching'), and att=val -> search time
+    shardText, ruleKeys = task
+    shardCorpus = Corpus(shardText)
+    position = {thisID: nr for nr, thisID in enumerate(shardCorpus)}
+    found = {}
+    seconds = {}
+    for attVal in ruleKeys:
+        start = time.perf_counter()
+        found[attVal] = [(position[match['sent_id']], match['matching']) for match in shardCorpus.search(workerRequests[attVal])]
+        seconds[attVal] = time.perf_counter() - start
+    shardCorpus.clean()
+    return(found, seconds)
+
+def searchParallel (udCorpus, requestDict, ruleKeys, shards):
+    # option --workers: search the rules in ruleKeys on corpus shards in a process pool
+    #   option --split_rules: the rules are split into groups as well, one task per shard and group
+    #   returns att=val -> list of matches (format of udCorpus.search()), graphs in corpus order
+    global searchPool
+    sentIDs = list(udCorpus)   # graph positions -> sent_id of the whole chunk
+    if sum(nr for text, nr in shards) != len(sentIDs):
+        print("  WARNING: shards do not match the corpus, searching without workers")
+        return({})
+    if searchPool is None:
+        # spawn (not fork): each worker needs its own grew backend
+        context = multiprocessing.get_context('spawn')
+        searchPool = context.Pool(args.workers, initializer=initSearchWorker, initargs=(args, requestDict))
+    nrGroups = max(1, min(args.split_rules, len(ruleKeys)))
+    groups = [ruleKeys[g::nrGroups] for g in range(nrGroups)]
+    tasks = []
+    offsets = []
+    offset = 0
+    for shardText, nr in shards:
+        for group in groups:
+            tasks.append((shardText, group))
+            offsets.append(offset)
+        offset += nr
+    print(f"  Searching {len(ruleKeys)} rule(s) in {len(shards)} shard(s) x {nrGroups} rule group(s) with {args.workers} workers...")
+    found = {attVal: [] for attVal in ruleKeys}
+    # results are merged in task order: shards in corpus order
+    #   option --profile: the search time of a rule is summed over the workers
+    for offset, (result, seconds) in zip(offsets, searchPool.imap(searchShard, tasks)):
+        for attVal in result.keys():
+            found[attVal] += [{'sent_id': sentIDs[offset + nr], 'matching': matching} for nr, matching in result[attVal]]
+            profileRule(attVal, seconds[attVal], engine='parallel')
+    return(found)
+
+# -------------------------------------------------------
+# match cache (option --cache)
+# -------------------------------------------------------
+"""
+The match cache is a SQLite file with the results of udCorpus.search() for each rule and sentence:
+  rule = hash of pattern and without, sentence = hash of the graph content (nodes, edges, order)
+Only new or modified rules and sentences are searched, cached matches are replayed through addCoding.
+"""
+def openCache ():
+    # open the match cache (once per process)
+    global matchCache
+    if matchCache is None:
+        matchCache = sqlite3.connect(args.cache, timeout=600)
+        matchCache.execute('CREATE TABLE IF NOT EXISTS matches (rule TEXT, sentence TEXT, result TEXT, PRIMARY KEY (rule, sentence))')
+        matchCache.execute('CREATE TEMP TABLE chunk (position INTEGER PRIMARY KEY, sentence TEXT)')
+    return(matchCache)
+
+def graphHash (graph):
+    # content hash of a graph (meta data, e.g. sent_id, do not change the matches)
+    data = graph.json_data()
+    content = json.dumps([data['nodes'], data['edges'], data.get('order', [])], sort_keys=True, ensure_ascii=False)
+    return(hashlib.sha1(content.encode('utf-8')).hexdigest())
+
+def searchCached (udCorpus, requestDict, ruleKeys, shards=None):
+    # option --cache: search the rules in ruleKeys, using and updating the match cache
+    #   returns att=val -> list of matches (format of udCorpus.search()), graphs in corpus order
+    cache = openCache()
+    sentIDs = list(wholeCorpus.keys())
+    hashes = [graphHash(wholeCorpus[thisID]) for thisID in sentIDs]
+    cache.execute('DELETE FROM chunk')
+    cache.executemany('INSERT INTO chunk VALUES (?, ?)', enumerate(hashes))
+    cached = {}
+    missing = {}
+    for attVal in ruleKeys:
+        cached[attVal] = dict(cache.execute('SELECT chunk.position, matches.result FROM chunk JOIN matches ON matches.sentence = chunk.sentence AND matches.rule = ?', (ruleHashes[attVal],)))
+        missing[attVal] = [nr for nr in range(len(sentIDs)) if not nr in cached[attVal]]
+    nrPairs = len(sentIDs) * len(ruleKeys)
+    nrCached = sum(len(cached[attVal]) for attVal in ruleKeys)
+    print(f"  Match cache: {nrCached} of {nrPairs} rule/sentence pairs found in {args.cache}")
+
+    # search new rules on the whole corpus, modified rules only on the missing sentences
+    searched = {}
+    fullRules = [attVal for attVal in ruleKeys if missing[attVal] and len(missing[attVal]) == len(sentIDs)]
+    partRules = [attVal for attVal in ruleKeys if missing[attVal] and len(missing[attVal]) < len(sentIDs)]
+    if fullRules and shards is not None:
+        searched.update(searchParallel(udCorpus, requestDict, fullRules, shards))
+    for attVal in fullRules:
+        if not attVal in searched:
+            start = time.perf_counter()
+            searched[attVal] = udCorpus.search(requestDict[attVal])
+            profileRule(attVal, time.perf_counter() - start, engine='grew')
+    if partRules:
+        subset = sorted(set(nr for attVal in partRules for nr in missing[attVal]))
+        missingCorpus = Corpus({sentIDs[nr]: wholeCorpus[sentIDs[nr]] for nr in subset})
+        for attVal in partRules:
+            start = time.perf_counter()
+            searched[attVal] = missingCorpus.search(requestDict[attVal])
+            profileRule(attVal, time.perf_counter() - start, engine='grew')
+        missingCorpus.clean()
+
+    # store the new results and replay all matches in corpus order
+    position = {thisID: nr for nr, thisID in enumerate(sentIDs)}
+    found = {}
+    for attVal in ruleKeys:
+        new = defaultdict(list)
+        for match in searched.get(attVal, []):
+            new[position[match['sent_id']]].append(match['matching'])
+        cache.executemany('INSERT OR REPLACE INTO matches VALUES (?, ?, ?)',
+                          [(ruleHashes[attVal], hashes[nr], json.dumps(new.get(nr, []))) for nr in missing[attVal]])
+        missingSet = set(missing[attVal])
+        foundList = []
+        for nr, thisID in enumerate(sentIDs):
+            if nr in missingSet:
+                matchings = new.get(nr, [])
+            elif cached[attVal][nr] != '[]':
+                matchings = json.loads(cached[attVal][nr])
+            else:
+                continue
+            foundList += [{'sent_id': thisID, 'matching': matching} for matching in matchings]
+        found[attVal] = foundList
+        profileRule(attVal, engine='cache')
+    cache.commit()
+    return(found)
+
+# -------------------------------------------------------
+# compact corpus (option --compact)
+# -------------------------------------------------------
+"""
+CompactCorpus keeps the graphs of a chunk in typed arrays instead of grew Graph objects (dicts of dicts):
+  - node features form, lemma, upos, xpos, textform: one column each, other features: one tuple per node
+  - edges: source, target and label columns (labels = deprels or grew feature structures)
+  - all values (strings, node ids, tuples) are interned in one vocabulary, the columns hold their numbers (0 = missing)
+  - meta data: one dict per graph (modified in place, e.g. by serializeCodings)
+The graphs are read through CompactGraph views, which build json_data() and to_conll() on demand.
+"""
+class CompactCorpus:
+    columns = ['form', 'lemma', 'upos', 'xpos', 'textform']
+
+    def __init__ (self, udCorpus=None, text=None):
+        # copy the graphs of a grew Corpus (None: empty, see readSidecar), text = its CoNLL-U string (see addText)
+        self.values = [None]        # number -> value
+        self.numbers = {None: 0}    # value -> number
+        self.nodeStart = array('I', [0])    # graph -> first node, first edge, first order position
+        self.edgeStart = array('I', [0])
+        self.orderStart = array('I', [0])
+        self.node = array('I')              # node id
+        self.feats = {col: array('I') for col in self.columns}
+        self.otherFeats = array('I')        # tuple of (feature, value) pairs
+        self.edgeSrc = array('I')
+        self.edgeTar = array('I')
+        self.edgeLabel = array('I')
+        self.order = array('I')
+        self.meta = []
+        self.sentIDs = []
+        self.position = {}   # sent_id -> graph number
+        if udCorpus is not None:
+            if text is not None:
+                self.addText(text, udCorpus.get_sent_ids())
+            else:   # one backend request per graph
+                for thisID in udCorpus.get_sent_ids():
+                    self.add(thisID, udCorpus[thisID])
+
+    def addText (self, text, sentIDs):
+        # convert the graphs of a CoNLL-U string in batches of compactBatch sentences:
+        #   grew parses each batch as a small corpus whose graphs are fetched in one request (like searchShard),
+        #   so that only one batch of grew Graphs is in memory
+        #   sentIDs = the sent_ids of the whole corpus in file order (sentences without sent_id are named by position)
+        offset = 0
+        for batchText in readChunks(io.StringIO(text), compactBatch):
+            batch = Corpus(batchText)
+            batchIDs = batch.get_sent_ids()
+            if offset + len(batchIDs) > len(sentIDs):
+                break
+            graphs = batch.get_all()
+            for batchID in batchIDs:
+                self.add(sentIDs[offset], graphs.pop(batchID))
+                offset += 1
+            batch.clean()
+        if offset != len(sentIDs):
+            raise ValueError(f"the text and the corpus do not have the same number of sentences ({len(sentIDs)} in the corpus)")
+
+    def arrays (self):
+        # the typed arrays by name (see writeSidecar)
+        arrays = {'nodeStart': self.nodeStart, 'edgeStart': self.edgeStart, 'orderStart': self.orderStart, 'node': self.node,
+                  'otherFeats': self.otherFeats, 'edgeSrc': self.edgeSrc, 'edgeTar': self.edgeTar, 'edgeLabel': self.edgeLabel, 'order': self.order}
+        for col in self.columns:
+            arrays['feats_' + col] = self.feats[col]
+        return(arrays)
+
+    def intern (self, value):
+        number = self.numbers.get(value)
+        if number is None:
+            number = self.numbers[value] = len(self.values)
+            self.values.append(value)
+        return(number)
+
+    def add (self, thisID, graph):
+        data = graph.json_data()
+        for node, features in data['nodes'].items():
+            self.node.append(self.intern(node))
+            for col in self.columns:
+                self.feats[col].append(self.intern(features.get(col)))
+            self.otherFeats.append(self.intern(tuple((key, value) for key, value in features.items() if not key in self.columns)))
+        for edge in data['edges']:
+            self.edgeSrc.append(self.intern(edge['src']))
+            self.edgeTar.append(self.intern(edge['tar']))
+            label = edge['label']
+            self.edgeLabel.append(self.intern(label if isinstance(label, str) else ('', tuple(label.items()))))
+        for node in data.get('order', []):
+            self.order.append(self.intern(node))
+        self.nodeStart.append(len(self.node))
+        self.edgeStart.append(len(self.edgeSrc))
+        self.orderStart.append(len(self.order))
+        self.meta.append(dict(data['meta']))
+        self.position[thisID] = len(self.sentIDs)
+        self.sentIDs.append(thisID)
+
+    def rekey (self, graphs):
+        # new sent_ids: graphs = dictionary sent_id -> CompactGraph (see checkIDs)
+        self.sentIDs = list(graphs.keys())
+        self.position = {thisID: graph.nr for thisID, graph in graphs.items()}
+        return(self)
+
+    def features (self, n):
+        # the feature dict of node number n
+        values = self.values
+        features = {}
+        for col in self.columns:
+            if self.feats[col][n]:
+                features[col] = values[self.feats[col][n]]
+        features.update(values[self.otherFeats[n]])
+        return(features)
+
+    def keys (self):
+        return(list(self.sentIDs))
+
+    def __iter__ (self):
+        return(iter(list(self.sentIDs)))
+
+    def __len__ (self):
+        return(len(self.sentIDs))
+
+    def __contains__ (self, thisID):
+        return(thisID in self.position)
+
+    def __getitem__ (self, thisID):
+        return(CompactGraph(self, self.position[thisID]))
+
+class CompactGraph:
+    # view of graph number nr of a CompactCorpus, with the methods of grew Graphs used here
+    def __init__ (self, corpus, nr):
+        self.corpus = corpus
+        self.nr = nr
+        self.meta = corpus.meta[nr]
+
+    def node (self, node):
+        # the features of one node
+        corpus = self.corpus
+        number = corpus.numbers.get(node)
+        for n in range(corpus.nodeStart[self.nr], corpus.nodeStart[self.nr + 1]):
+            if corpus.node[n] == number:
+                return(corpus.features(n))
+        raise KeyError(node)
+
+    def json_data (self):
+        # the graph in grew's JSON format (the meta data is not copied)
+        corpus = self.corpus
+        values = corpus.values
+        nodes = {values[corpus.node[n]]: corpus.features(n) for n in range(corpus.nodeStart[self.nr], corpus.nodeStart[self.nr + 1])}
+        edges = []
+        for e in range(corpus.edgeStart[self.nr], corpus.edgeStart[self.nr + 1]):
+            label = values[corpus.edgeLabel[e]]
+            edges.append({'src': values[corpus.edgeSrc[e]], 'label': label if isinstance(label, str) else dict(label[1]), 'tar': values[corpus.edgeTar[e]]})
+        order = [values[corpus.order[o]] for o in range(corpus.orderStart[self.nr], corpus.orderStart[self.nr + 1])]
+        return({'nodes': nodes, 'edges': edges, 'order': order, 'meta': self.meta})
+
+    def to_conll (self):
+        return(Graph(self.json_data()).to_conll())
+
+class LazyCorpus:
+    # a grew Corpus that is only loaded by the backend when it is searched (option --sidecar)
+    #   load: function returning the Corpus, length: number of graphs
+    def __init__ (self, load, length):
+        self.load = load
+        self.length = length
+        self.udCorpus = None
+
+    def corpus (self):
+        if self.udCorpus is None:
+            print("  Loading the corpus into grew...")
+            self.udCorpus = self.load()
+        return(self.udCorpus)
+
+    def search (self, request):
+        return(self.corpus().search(request))
+
+    def __iter__ (self):
+        return(iter(self.corpus()))
+
+    def __len__ (self):
+        return(self.length)
+
+    def clean (self):
+        if self.udCorpus is not None:
+            self.udCorpus.clean()
+
+# -------------------------------------------------------
+# binary sidecar (option --sidecar)
+# -------------------------------------------------------
+"""
+The sidecar <input>.udc stores the CompactCorpus of an input file:
+  'UDC1', length of the JSON header (8 bytes), JSON header, then the typed arrays (8-byte aligned)
+  and the marshalled vocabulary, meta data and sent_ids
+The arrays are used directly from the memory-mapped file, pages are shared between processes.
+The header has size, modification time and sha1 of the input; the sidecar is rebuilt if the input changed.
+"""
+sidecarFormat = 1
+
+def sidecarName (fileName):
+    return(fileName + '.udc')
+
+def fileHash (fileName):
+    # sha1 of the content of a file
+    sha1 = hashlib.sha1()
+    with open(fileName, 'rb') as input:
+        for block in iter(lambda: input.read(1 << 20), b''):
+            sha1.update(block)
+    return(sha1.hexdigest())
+
+def writeSidecar (fileName, corpus):
+    # write the CompactCorpus of fileName to its sidecar (before the codings are added to the meta data)
+    sidecar = sidecarName(fileName)
+    stat = os.stat(fileName)
+    header = {'format': sidecarFormat, 'marshal': marshal.version, 'byteorder': sys.byteorder, 'columns': CompactCorpus.columns,
+              'source': {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': fileHash(fileName)}, 'arrays': {}, 'blobs': {}}
+    blocks = []
+    offset = 0
+    for name, values in corpus.arrays().items():
+        data = values.tobytes()
+        header['arrays'][name] = (offset, len(data))
+        blocks.append(data + b'\0' * (-len(data) % 8))
+        offset += len(blocks[-1])
+    for name, value in [('values', corpus.values), ('meta', corpus.meta), ('sentIDs', corpus.sentIDs)]:
+        data = marshal.dumps(value)
+        header['blobs'][name] = (offset, len(data))
+        blocks.append(data + b'\0' * (-len(data) % 8))
+        offset += len(blocks[-1])
+    headerData = json.dumps(header).encode('utf-8')
+    headerData += b' ' * (-(len(headerData) + 12) % 8)
+    try:
+        with open(sidecar + '.tmp', 'wb') as out:
+            out.write(b'UDC1' + len(headerData).to_bytes(8, 'little') + headerData)
+            for block in blocks:
+                out.write(block)
+        os.replace(sidecar + '.tmp', sidecar)
+        print(f"Binary corpus written to {sidecar}")
+    except OSError as e:
+        print(f"  WARNING: cannot write {sidecar}: {e}")
+
+def readSidecar (fileName):
+    # memory-map the sidecar of fileName
+    #   returns a CompactCorpus, or None if there is no sidecar or it does not match the input (then it is rebuilt)
+    sidecar = sidecarName(fileName)
+    if not os.path.isfile(sidecar):
+        return(None)
+    with open(sidecar, 'rb') as input:
+        mapped = mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:4] != b'UDC1':
+        print(f"  WARNING: {sidecar} is not a sidecar file, rebuilding")
+        return(None)
+    headerLength = int.from_bytes(mapped[4:12], 'little')
+    header = json.loads(mapped[12:12 + headerLength].decode('utf-8'))
+    if (header['format'], header['marshal'], header['byteorder'], header['columns']) != (sidecarFormat, marshal.version, sys.byteorder, CompactCorpus.columns):
+        print(f"  Sidecar {sidecar} was written by another version, rebuilding")
+        return(None)
+    stat = os.stat(fileName)
+    source = header['source']
+    if stat.st_size != source['size'] or (stat.st_mtime_ns != source['mtime'] and fileHash(fileName) != source['sha1']):
+        print(f"  Sidecar {sidecar} is outdated, rebuilding")
+        return(None)
+    start = 12 + headerLength
+    corpus = CompactCorpus()
+    corpus.mapped = mapped   # keep the mapping open
+    view = memoryview(mapped)
+    arrays = {name: view[start + offset:start + offset + length].cast('I') for name, (offset, length) in header['arrays'].items()}
+    for name in ['nodeStart', 'edgeStart', 'orderStart', 'node', 'otherFeats', 'edgeSrc', 'edgeTar', 'edgeLabel', 'order']:
+        setattr(corpus, name, arrays[name])
+    corpus.feats = {col: arrays['feats_' + col] for col in CompactCorpus.columns}
+    blobs = {name: marshal.loads(mapped[start + offset:start + offset + length]) for name, (offset, length) in header['blobs'].items()}
+    corpus.values = blobs['values']
+    corpus.numbers = {value: number for number, value in enumerate(corpus.values)}
+    corpus.meta = blobs['meta']
+    corpus.sentIDs = blobs['sentIDs']
+    corpus.position = {thisID: nr for nr, thisID in enumerate(corpus.sentIDs)}
+    print(f"Binary corpus read from {sidecar}: {len(corpus)} graphs")
+    return(corpus)
+
+def graphMeta (graph):
+    # the meta data of a grew Graph or CompactGraph (without converting the nodes of a CompactGraph)
+    if isinstance(graph, CompactGraph):
+        return(graph.meta)
+    return(graph.json_data()['meta'])
+
+def nodeFeatures (graph, node):
+    # the features of a node of a grew Graph or CompactGraph
+    if isinstance(graph, CompactGraph):
+        return(graph.node(node))
+    return(graph.json_data()['nodes'][node])
+
+def draftOrder (draft):
+    # the sent_ids of a CorpusDraft or CompactCorpus in file order
+    #   a CorpusDraft made from a Corpus keeps the file order in _sent_ids, its dict order may differ
+    order = getattr(draft, '_sent_ids', None)
+    if order is None or len(order) != len(draft):
+        return(list(draft.keys()))
+    return(list(order))
+
+def newDraft (udCorpus, data=None):
+    # the modifiable copy of the graphs of udCorpus (wholeCorpus): CorpusDraft, or CompactCorpus with --compact, --sidecar
+    #   data = the CoNLL-U string of udCorpus (CompactCorpus converts it in batches)
+    if args.compact or args.sidecar:
+        return(CompactCorpus(udCorpus, data))
+    return(CorpusDraft(udCorpus))
+
+def draftCorpus (draft):
+    # a searchable grew Corpus with the graphs of a CorpusDraft or CompactCorpus
+    if isinstance(draft, CompactCorpus):
+        return(Corpus({thisID: draft[thisID] for thisID in draft.keys()}))
+    return(Corpus(draft))
+
+# -------------------------------------------------------
+# profiling (option --profile)
+# -------------------------------------------------------
+def newProfile ():
+    # empty profile: phase -> seconds, att=val -> search time, coding time, matches and engine
+    return({'phases': {}, 'rules': {}})
+
+def profilePhase (name, start):
+    # option --profile: add the time since start (time.perf_counter()) to a phase
+    if profile is not None:
+        with profileLock:
+            profile['phases'][name] = profile['phases'].get(name, 0.0) + time.perf_counter() - start
+
+def profileRule (attVal, seconds=0.0, matches=0, coding=0.0, engine=None):
+    # option --profile: add search time, matches and coding time of a rule
+    if profile is None:
+        return
+    rule = profile['rules'].setdefault(attVal, {'seconds': 0.0, 'matches': 0, 'coding_seconds': 0.0, 'engines': []})
+    rule['seconds'] += seconds
+    rule['matches'] += matches
+    rule['coding_seconds'] += coding
+    if engine is not None and not engine in rule['engines']:
+        rule['engines'].append(engine)
+
+def mergeProfile (other):
+    # option --profile: add the profile of a worker process
+    for name, seconds in other['phases'].items():
+        profile['phases'][name] = profile['phases'].get(name, 0.0) + seconds
+    for attVal, rule in other['rules'].items():
+        profileRule(attVal, rule['seconds'], rule['matches'], rule['coding_seconds'])
+        for engine in rule['engines']:
+            profileRule(attVal, engine=engine)
+
+def peakRSS ():
+    # peak resident set size of this process and of the finished child processes in MB (ru_maxrss: KB on Linux, bytes on macOS)
+    unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return(round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1), round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit, 1))
+
+def writeProfile (requestDict):
+    # option --profile: write the profile as JSON (or TSV for file names *.tsv, *.csv)
+    #   option --profile_summary: print phases and rules sorted by time to stderr
+    rss, rssChildren = peakRSS()
+    rules = []   # in the order of the request file (--serve: rules of modified request files at the end)
+    for attVal in list(requestDict.keys()) + [key for key in profile['rules'] if not key in requestDict]:
+        if attVal in profile['rules']:
+            rule = profile['rules'][attVal]
+            rules.append({'rule': attVal, 'seconds': round(rule['seconds'], 6), 'matches': rule['matches'],
+                          'coding_seconds': round(rule['coding_seconds'], 6), 'engine': ','.join(rule['engines'])})
+    phases = {name: round(seconds, 6) for name, seconds in profile['phases'].items()}
+    print(f"Writing the profile to {args.profile}")
+    if re.search(r'\.(tsv|csv)$', args.profile):
+        with open(args.profile, 'w', newline='') as out:
+            writer = csv.writer(out, delimiter='\t')
+            writer.writerow(['type', 'name', 'seconds', 'matches', 'coding_seconds', 'engine'])
+            for name, seconds in phases.items():
+                writer.writerow(['phase', name, seconds, '', '', ''])
+            for rule in rules:
+                writer.writerow(['rule', rule['rule'], rule['seconds'], rule['matches'], rule['coding_seconds'], rule['engine']])
+            writer.writerow(['memory', 'peak_rss_mb', rss, '', '', ''])
+            writer.writerow(['memory', 'peak_rss_children_mb', rssChildren, '', '', ''])
+    else:
+        with open(args.profile, 'w') as out:
+            json.dump({'command': sys.argv, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'peak_rss_mb': rss, 'peak_rss_children_mb': rssChildren,
+                       'phases': phases, 'rules': rules}, out, indent=2, ensure_ascii=False)
+    if args.profile_summary:
+        print("Profile: phases", file=sys.stderr)
+        for name, seconds in sorted(phases.items(), key=lambda x: -x[1]):
+            print(f"  {seconds:10.3f} s  {name}", file=sys.stderr)
+        print("Profile: rules by search time (seconds, matches, coding seconds, engine)", file=sys.stderr)
+        for rule in sorted(rules, key=lambda x: -x['seconds']):
+            print(f"  {rule['seconds']:10.3f} s  {rule['matches']:8d}  {rule['coding_seconds']:8.3f} s  {rule['engine']:<8} {rule['rule']}", file=sys.stderr)
+        print(f"Profile: peak RSS {rss} MB (finished child processes: {rssChildren} MB)", file=sys.stderr)
+
+def processRules (udCorpus, requestDict, shards=None):
     # udCorpus is a grew Corpus object
-    # wholeCorpus is a grew CorpusDraft object (i.e. a dictionary that can be modified)
+    # wholeCorpus is a grew CorpusDraft object (i.e. a dictionary that can be modified), or a CompactCorpus
+    # shards: option --workers, the corpus split by splitShards()
     # --------------------------
     # for each request rule, apply it to the Corpus (udCorpus)
     #   - each rule returns a list of matching graphs
@@ -122,16 +1287,69 @@ def processRules (udCorpus, requestDict):
     #   - for each att-value pair, the match list is stored in a dictionary
     foundRuleList = defaultdict(list)
     matchedRules = defaultdict(list)
+    codings = defaultdict(dict)  # sent_id -> node -> coding (see addCoding)
     print(f"Matching {len(udCorpus)} graphs against rules...", end = '\n')
+    start = time.perf_counter()
+    indexMatches = {}
+    # option --first_rule: skip searches on verb nodes already coded for the attribute (not with --cache and --workers)
+    pruning = args.first_rule and args.cache == '' and shards is None
+    coded = codedNodes() if pruning else None
+    if args.engine == 'index':   # single pass for all compiled requests
+        indexMatches = searchIndex(requestDict, coded)
+    ruleKeys = [key for key in requestDict.keys() if not key in indexMatches]
+    if args.cache != '' and ruleKeys:   # the other requests are replayed from the match cache or searched
+        indexMatches.update(searchCached(udCorpus, requestDict, ruleKeys, shards))
+    elif shards is not None and ruleKeys:   # the other requests are searched in parallel
+        indexMatches.update(searchParallel(udCorpus, requestDict, ruleKeys, shards))
+    # prefilter: inverted index for the rules searched with grew (not with --cache and --workers)
+    prefilter = None
+    if args.prefilter and args.cache == '' and shards is None:
+        requirements = [prefilterRules[attVal] for attVal in ruleKeys if prefilterRules.get(attVal)]
+        if requirements:
+            prefilter = prefilterIndex([requirement for rule in requirements for requirement in rule])
+    if pruning:
+        # rules searched with grew: candidates for V, if the attribute can be coded before the rule
+        seenAtts = set(coded.keys())
+        pruneKeys = []
+        for attVal in requestDict.keys():
+            if not attVal in indexMatches and ruleAttribute(attVal) in seenAtts:
+                pruneKeys.append(attVal)
+            seenAtts.add(ruleAttribute(attVal))
+        candidates = ruleCandidates(pruneKeys)
     for attVal in requestDict.keys():
-        foundList = udCorpus.search(requestDict[attVal])  # list of JSON matches, with sent_id, nodes, edges
+        if attVal in indexMatches:
+            foundList = indexMatches[attVal]
+        else:
+            ruleStart = time.perf_counter()
+            sentIDs = None   # graphs to be searched (None = all)
+            if prefilter is not None and prefilterRules.get(attVal):
+                sentIDs = prefilterGraphs(prefilter, prefilterRules[attVal])
+            if pruning and attVal in candidates:
+                uncoded = uncodedGraphs(candidates[attVal], coded.get(ruleAttribute(attVal), {}))
+                sentIDs = uncoded if sentIDs is None else sentIDs & uncoded
+            searchCorpus = subCorpus(udCorpus, sentIDs)
+            foundList = []
+            if searchCorpus is not None:
+                foundList = searchCorpus.search(requestDict[attVal])  # list of JSON matches, with sent_id, nodes, edges
+                if searchCorpus is not udCorpus:
+                    searchCorpus.clean()
+            profileRule(attVal, time.perf_counter() - ruleStart, engine='grew')
+        if pruning:   # the verb nodes coded by this rule
+            attCoded = coded[ruleAttribute(attVal)]
+            for match in foundList:
+                attCoded.setdefault(match['sent_id'], set()).add(match['matching']['nodes']['V'])
+        profileRule(attVal, matches=len(foundList))
         matchedRules[attVal] = len(foundList)
         if len(foundList) > 0:
             foundRuleList[attVal] = foundList
 
+    profilePhase('search', start)
+
     # for each att-value pair get the list
+    start = time.perf_counter()
     ruleCount = 0
     for attVal in foundRuleList.keys():   ## patterns.keys():
+        ruleStart = time.perf_counter()
         ruleCount += 1
         print(f"  Adding coding for rule {ruleCount} of {len(foundRuleList.keys())}:  {attVal} ({matchedRules[attVal]} matches)") #  <- {requestDict[attVal]} 
         listMatches = foundRuleList[attVal] # this is the list of matching graphs (json)
@@ -143,421 +1361,1420 @@ def processRules (udCorpus, requestDict):
             thisDict = thisList['matching']['nodes']
             if 'C' in thisList['matching']['nodes'].keys():
                 node2 = thisDict['C']
-            graph = wholeCorpus[thisID]
-            wholeCorpus[thisID] = addCoding(graph, thisDict['V'], attVal, node2)  # update meta info of this graph
+            addCoding(codings[thisID], wholeCorpus[thisID], thisDict['V'], attVal, node2)  # update the codings of this graph
+        profileRule(attVal, coding=time.perf_counter() - ruleStart)
+    serializeCodings(codings)  # update meta info of the graphs
+    profilePhase('add_coding', start)
 
     udCorpus.clean() # free memory
     return(wholeCorpus) # return the modified CorpusDraft object
 
-def addCoding (js, govNode, codingString, node2):
-    # for graph js, add a coding attribute to meta and append codingString
-    global codingAtt
-    codingIndex = "coding_" + govNode
-    # initialize new coding string with verb info (if available)
-    if not codingIndex in js.json_data()["meta"]:
-        js.json_data()["meta"][codingIndex] = ''
-        for att in ["textform", "lemma", "xpos"]:
-            if att in js.json_data()['nodes'][govNode].keys():
-                js.json_data()["meta"][codingIndex] += ';' +att+'='+js.json_data()['nodes'][govNode][att] 
-                if not att in codingAtt:
-                    codingAtt.append(att)  # collect attributes in a list
-        js.json_data()["meta"][codingIndex] = js.json_data()["meta"][codingIndex][1:]
+def addCoding (codings, js, govNode, codingString, node2):
+    # for graph js, append codingString to the coding of node govNode
+    #   codings: the codings of graph js, a dictionary node -> coding
+    #   coding: {'prefix': verb info or coding string from the input,
+    #            'items': list of (codingString, target node info), 'atts': set of coded attributes}
+    #   the coding_<node> meta strings are written by serializeCodings()
+    coding = codings.get(govNode)
+    if coding is None:
+        meta = graphMeta(js)
+        codingIndex = "coding_" + govNode
+        if codingIndex in meta:   # append to the coding string of the input
+            prefix = meta[codingIndex]
+        else:   # initialize new coding string with verb info (if available)
+            features = nodeFeatures(js, govNode)
+            verbInfo = []
+            for att in ["textform", "lemma", "xpos"]:
+                if att in features:
+                    verbInfo.append(att + '=' + features[att])
+                    if not att in codingAtt:
+                        codingAtt.append(att)  # collect attributes in a list
+            prefix = ';'.join(verbInfo)
+        # attributes after the first pair (the coding string used to be searched for ';att=')
+        coding = {'prefix': prefix, 'items': [], 'atts': set(pair.split('=')[0] for pair in prefix.split(';')[1:])}
+        codings[govNode] = coding
     # ...append coding string to existing string
     thisAtt, thisVal = codingString.split('=')
-    thisAtt = re.sub(r';', '_', thisAtt)
+    thisAtt = thisAtt.replace(';', '_')
     # Option --first_rule: don't overwrite this attribute
-    if args.first_rule and re.search(';'+thisAtt+'=', js.json_data()["meta"][codingIndex]):
-        return(js)
-    else:
-        js.json_data()["meta"][codingIndex] += ';' + codingString
-        # add attribute to list
-        if not thisAtt in codingAtt:
-            codingAtt.append(thisAtt)  # append to the global list of attributes
-        # add info for second node (TODO: experimental)
-        if args.keep_target_node_info:
-            if node2 != 0:
-                node2Info = str(node2)
-                if 'textform' in js.json_data()['nodes'][node2].keys():
-                    node2Info += '_' + js.json_data()['nodes'][node2]['textform']
-                js.json_data()["meta"][codingIndex] += '(' + node2Info + ')'
-    return(js)
-
-def checkIDs (udCorpus):
-    # for each Graph in udCorpus, add meta information sent_id and text if not existant
-    print(f"Verifying or inserting meta information...")
-    sNr = 0
+    if args.first_rule and thisAtt in coding['atts']:
+        return
+    # add info for second node (TODO: experimental)
+    target = ''
+    if args.keep_target_node_info and node2 != 0:
+        node2Info = str(node2)
+        features = nodeFeatures(js, node2)
+        if 'textform' in features:
+            node2Info += '_' + features['textform']
+        target = '(' + node2Info + ')'
+    coding['items'].append((codingString, target))
+    coding['atts'].add(thisAtt)
+    # add attribute to list
+    if not thisAtt in codingAtt:
+        codingAtt.append(thisAtt)  # append to the global list of attributes
+
+def joinCoding (coding):
+    # the coding_<node> meta string of a coding (see addCoding)
+    return(coding['prefix'] + ''.join(';' + item + target for item, target in coding['items']))
+
+def codingPairs (coding):
+    # attribute-value pairs of a coding, for the table (target node info is removed unless -k is used)
+    pairs = splitCodingString(coding['prefix'])
+    for item, target in coding['items']:
+        attribute, value = item.split('=')
+        pairs.append((attribute, value + target))
+    return(pairs)
+
+def splitCodingString (codeStr):
+    # attribute-value pairs of a coding_<node> meta string
+    pairs = []
+    for pair in codeStr.split(';'):
+        if pair.count('=') == 1:
+            attribute, value = pair.split('=')
+        else:
+            attribute = pair[:pair.find('=')]
+            value = pair[pair.find('='):] + "_ERROR"
+            print(f"  WARNING: pair {pair} is not well formed")
+        pairs.append((attribute, value))
+    return(pairs)
+
+def serializeCodings (codings):
+    # write the codings to the meta data of the graphs in wholeCorpus (once, after all rules are applied)
+    global graphCodings
+    for thisID in codings.keys():
+        meta = graphMeta(wholeCorpus[thisID])
+        for govNode, coding in codings[thisID].items():
+            meta["coding_" + govNode] = joinCoding(coding)
+    graphCodings = codings  # kept for writeTable()
+
+def checkIDs (draft, sentOffset=0):
+    # for each Graph in the CorpusDraft draft, add meta information sent_id and text if not existant
+    #   inserted sent_ids are numbered from sentOffset+1 (--chunk_size: continue numbering across chunks)
+    #   the meta data is modified in place, returns a CorpusDraft (or CompactCorpus) with the same graphs keyed by sent_id
+    print("Verifying or inserting meta information...")
+    sNr = sentOffset
     found = corrected = nameAdded = 0
-    output = []
-    for s in udCorpus:
+    output = {}
+    for s in draftOrder(draft):   # inserted sent_ids are numbered in file order
         sNr += 1
-        graph = udCorpus[s]
-        if 'sent_id' in graph.json_data()["meta"]:
+        graph = draft[s]
+        meta = graphMeta(graph)
+        if 'sent_id' in meta:
             found += 1
         else:
-            graph.json_data()["meta"]['sent_id'] = str(sNr)
+            meta['sent_id'] = str(sNr)
             corrected +=1
-        if not 'text' in graph.json_data()["meta"] and '' in graph.json_data()["meta"]:
-            graph.json_data()["meta"]['text'] = graph.json_data()["meta"]['']
-            del graph.json_data()["meta"]['']
+        if not 'text' in meta and '' in meta:
+            meta['text'] = meta['']
+            del meta['']
             nameAdded +=1
-        output.append(graph)
-    correctedCorpus = Corpus(output)
+        output[meta['sent_id']] = graph
     print(f"   Finished sent_id check: found={found}, inserted={corrected}, nameAdded={nameAdded}")
-    return(correctedCorpus, corrected)
+    if isinstance(draft, CompactCorpus):
+        return(draft.rekey(output), corrected)
+    return(CorpusDraft(output), corrected)
+
+def readChunks (input, chunkSize):
+    # read CoNLL-U sentence blocks incrementally from an open file
+    #   - yields CoNLL-U strings containing up to chunkSize sentences
+    #   - chunkSize <= 0: the whole file is returned as one chunk
+    if chunkSize <= 0:
+        yield input.read()
+        return
+    lines = []
+    nrSentences = 0
+    inSentence = False
+    for line in input:
+        if line.strip() == '':   # blank line = end of sentence
+            if inSentence:
+                lines.append('\n')
+                nrSentences += 1
+                inSentence = False
+                if nrSentences == chunkSize:
+                    yield ''.join(lines)
+                    lines = []
+                    nrSentences = 0
+            continue
+        if not line.endswith('\n'):
+            line += '\n'
+        lines.append(line)
+        inSentence = True
+    if inSentence:   # last sentence without final blank line
+        lines.append('\n')
+        nrSentences += 1
+    if nrSentences > 0:
+        yield ''.join(lines)
+
+def readSpliceChunks (input, chunkSize):
+    # option --splice: read CoNLL-U sentence blocks from a file opened in binary mode (like readChunks)
+    #   yields CoNLL-U strings containing up to chunkSize sentences (chunkSize <= 0: all) and a list of the sentences:
+    #   [start, metaEnd, end, metaLines] = byte offsets of the sentence, of its first line after the meta lines
+    #   and of its end in the input, and the meta lines as read (see spliceChunk)
+    lines = []
+    sentences = []
+    sentence = None
+    position = 0
+    for line in input:
+        if line.strip() == b'':   # blank line = end of sentence
+            if sentence is not None:
+                sentence[2] = position
+                sentences.append(sentence)
+                lines.append('\n')
+                sentence = None
+                if len(sentences) == chunkSize:
+                    yield(''.join(lines), sentences)
+                    lines = []
+                    sentences = []
+            position += len(line)
+            continue
+        text = line.decode('utf-8')
+        if sentence is None:
+            sentence = [position, position, position, []]
+        if text.startswith('#') and sentence[1] == position:   # meta line before the first token
+            sentence[1] = position + len(line)
+            sentence[3].append(text)
+        lines.append(text.rstrip('\r\n') + '\n')
+        position += len(line)
+    if sentence is not None:   # last sentence without final blank line
+        sentence[2] = position
+        sentences.append(sentence)
+        lines.append('\n')
+    if len(sentences) > 0:
+        yield(''.join(lines), sentences)
+
+def sentKey (thisID):
+    # sort key of a sent_id: the numbers in it are compared as numbers ('2' < '10', 'fro-2' < 'fro-10')
+    #   other sent_ids are sorted as strings
+    return([int(part) if nr % 2 else part for nr, part in enumerate(re.split(r'([0-9]+)', thisID))])
+
+def readText (fileName):
+    # the content of a (plain or compressed) CoNLL-U file
+    with openFile(fileName, 'r') as input:
+        return(input.read())
+
+def codeChunk (data, requestDict, sentOffset, fileName):
+    # code a block of CoNLL-U sentences (the whole file unless --chunk_size is used)
+    #   sentOffset = number of sentences in previous chunks (for sent_id insertion with -C)
+    #   fileName = the input file
+    #   returns the coded CorpusDraft and its keys in output order
+    global wholeCorpus
+    start = time.perf_counter()
+    # option --sidecar: the graphs from the binary sidecar of the input file, grew only loads the corpus if it is searched
+    #   (not with --chunk_size: the sidecar holds the whole file)
+    #   data = None: the text of the file is only read if there is no valid sidecar (see codeFile)
+    sidecar = args.sidecar and args.chunk_size <= 0
+    wholeCorpus = readSidecar(fileName) if sidecar else None
+    if wholeCorpus is None and data is None:
+        data = readText(fileName)
+    if wholeCorpus is not None:
+        # the text is not kept: if grew searches the whole corpus, it parses the file again
+        udCorpus = LazyCorpus(lambda: Corpus(readText(fileName)), len(wholeCorpus))
+    else:
+        # a Corpus object that can be searched using .search()
+        udCorpus = Corpus(data)
+    # option --workers: shards for parallel search (not within --batch workers)
+    shards = None
+    if args.workers > 1 and not multiprocessing.current_process().daemon:
+        if data is None:
+            data = readText(fileName)
+        shards = splitShards(data, args.workers)
+    if wholeCorpus is None:
+        # the same graphs in a global CorpusDraft object (= a modifiable dictionary), or a CompactCorpus (--compact)
+        print("Creating grewpy CorpusDraft...")
+        wholeCorpus = newDraft(udCorpus, data)
+        if sidecar:
+            writeSidecar(fileName, wholeCorpus)
+    del data
+    profilePhase('parse', start)
+    # option -C: verify or add sent_id to graph meta data
+    #   the meta data is fixed in the draft, which is re-keyed by sent_id and replaces the search corpus
+    if args.check_ids:
+        start = time.perf_counter()
+        print("Verifying sent_id in the corpus...")
+        wholeCorpus, corrected = checkIDs(wholeCorpus, sentOffset)
+        udCorpus.clean()
+        if isinstance(udCorpus, LazyCorpus):
+            udCorpus = LazyCorpus(lambda: draftCorpus(wholeCorpus), len(wholeCorpus))
+        else:
+            udCorpus = draftCorpus(wholeCorpus)
+        profilePhase('check_ids', start)
+    print("Processing rules...")
+    codedCorpus = processRules(udCorpus, requestDict, shards)   # cleans udCorpus
+    sorted_keys = sorted(codedCorpus.keys(), key=sentKey)
+    return(codedCorpus, sorted_keys)
+
+def declareCodingAtt (requestDict):
+    # option --chunk_size: the table header is written before all chunks are coded,
+    #   so the columns are declared in advance: verb info + attributes of all requests
+    for att in ["textform", "lemma", "xpos"] + [re.sub(r';', '_', key.split('=')[0]) for key in requestDict.keys()]:
+        if not att in codingAtt:
+            codingAtt.append(att)
+
+def tableFormat(fileName):
+    # format of the coding table: option --table_format, or from the file extension (default tsv)
+    if args.table_format != 'auto':
+        return(args.table_format)
+    ext = os.path.splitext(plainName(fileName))[1].lower()
+    return({'.parquet': 'parquet', '.feather': 'feather', '.arrow': 'feather'}.get(ext, 'tsv'))
 
-def writeTable(output):
-    # converts the output (list of graph objects) to a table
-    global codingAtt
+def openTable(fileName):
+    # open the coding table and write the header (tsv)
+    #   codingAtt must contain all coding attributes at this point
+    #   returns a dict with the table state, passed to writeTable and closeTable
     codingAtt.insert(0, 'node')
     codingAtt.insert(0, 'sent_id')
     codingAtt.insert(0, 'date')
     codingAtt.insert(0, 'text')
     codingAtt.insert(0, 'url')
     codingAtt.insert(0, 'text_id')
-    reCoding = re.compile('coding_(\d+)')  # label for coding strings
-    graphCodingDict = defaultdict() # codings for all the graphs
-    nrCodingDict = defaultdict()    #   for each coding line of one graph
-    attValDict = defaultdict()      #   for att-value pairs in one coding line
+    table = {'name': partName(fileName), 'format': tableFormat(fileName), 'file': None, 'writer': None, 'parts': []}
+    if table['format'] == 'tsv':
+        table['file'] = openFile(table['name'], 'w', newline='', buffering=writeBuffer)
+        writer = csv.DictWriter(table['file'], fieldnames=codingAtt, delimiter='\t') # attValDict.keys()  , quoting=csv.QUOTE_MINIMAL
+        writer.writeheader()
+    else:
+        if compressionSuffix(fileName) != '':
+            sys.exit(f"ERROR: {fileName}: {table['format']} tables are compressed by pyarrow, not by the file suffix")
+        if importlib.util.find_spec('pyarrow') is None:   # imported by writeTable
+            sys.exit(f"ERROR: the {table['format']} table format requires pyarrow (pip install pyarrow)")
+    return(table)
+
+def htmlURL(meta):
+    # option -H: spreadsheet hyperlink to the sentence on the server
+    if meta.get('sent_id') in htmlPages:  # option --html_page_size: the page of the sentence
+        return('=HYPERLINK(\"{}/{}/{}#{}\"; \"WWW\")'.format(htmlServer, htmlDir, htmlPages[meta['sent_id']], meta['sent_id']))
+    if args.html_file:  # specific html file
+        return('=HYPERLINK(\"{}/{}/{}#{}\"; \"WWW\")'.format(htmlServer, htmlDir, args.html_file, meta['sent_id']))
+    # default: name of html file is text_id
+    return('=HYPERLINK(\"{}/{}/{}#{}\"; \"WWW\")'.format(htmlServer, htmlDir, meta['text_id'], meta['sent_id']))
+
+def tableColumns(output, chunkCodings=None):
+    # collect the codings of the output (list of graph objects) in columns: one list per column of codingAtt
+    #   chunkCodings: the structured codings of the output (default graphCodings, see serializeCodings)
+    #   one row for each coding_N line, other meta lines are skipped
+    #   the values shared by the rows of a graph (text_id, url, text, date) are looked up once per graph
+    reCoding = re.compile(r'coding_(\d+)')  # label for coding strings
+    empty = args.table_empty_string
+    columns = {att: [] for att in codingAtt}
+    if chunkCodings is None:
+        chunkCodings = graphCodings
     countLine = 0
-    out = open(args.table, 'w', newline='')
-    writer = csv.DictWriter(out, fieldnames=codingAtt, delimiter='\t') # attValDict.keys()  , quoting=csv.QUOTE_MINIMAL
-    writer.writeheader()
-    print(f"Writing the coding table to {args.table}...", end='')
     for graph in output:
-        outRows = {}  
         countLine += 1
-        if 'sent_id' in graph.json_data()["meta"].keys():
-            thisID = graph.json_data()["meta"]['sent_id']
+        meta = graphMeta(graph)
+        codeKeys = []   # (meta key, node) of the coding lines
+        for key in meta:
+            codeMatch = reCoding.search(key)
+            if codeMatch:
+                codeKeys.append((key, codeMatch.group(1)))
+        if not codeKeys:
+            continue
+        thisID = meta['sent_id'] if 'sent_id' in meta else 'graph_' + str(countLine)
+        codings = chunkCodings.get(thisID, {})  # structured codings of this run
+        graphValues = {'sent_id': thisID}
+        for att in ['text_id', 'text', 'date']:
+            if att in meta:
+                graphValues[att] = meta[att]
+        if args.html:  # add a column for URLs pointing to corpus on server
+            graphValues['url'] = htmlURL(meta)
+
+        rows = {}   # node -> values of the row
+        for key, codeNr in codeKeys:
+            values = dict(graphValues)
+            values['node'] = codeNr
+            # att-value pairs from the codings of this run, or split from the coding string of the input
+            if codeNr in codings:
+                pairs = codingPairs(codings[codeNr])
+            else:
+                pairs = splitCodingString(meta[key])
+            for attribute, value in pairs:
+                if attribute in columns:   # only if in pre-defined columns
+                    if args.keep_target_node_info:
+                        value = value.split('(')[0]
+                    values[attribute] = value
+                else:
+                    print(f"  WARNING: skipping undefined attribute in pair: '{attribute}={value}'")
+            rows[codeNr] = values
+        for values in rows.values():
+            for att, column in columns.items():
+                column.append(str(values.get(att, empty)))
+    return(columns)
+
+def writeTable(table, output, chunkCodings=None):
+    # converts the output (list of graph objects) to table rows, written to the open table
+    #   tsv: rows are appended to the file, parquet: one row group per call, feather: written by closeTable
+    print(f"Writing the coding table to {table['name']}...", end='')
+    columns = tableColumns(output, chunkCodings)
+    if table['format'] == 'tsv':
+        table['file'].write(''.join('\t'.join(row) + '\n' for row in zip(*columns.values())))
+    else:
+        import pyarrow, pyarrow.parquet
+        arrowTable = pyarrow.table({att: pyarrow.array(column, type=pyarrow.string()) for att, column in columns.items()})
+        if table['format'] == 'parquet':
+            if table['writer'] is None:
+                table['writer'] = pyarrow.parquet.ParquetWriter(table['name'], arrowTable.schema)
+            table['writer'].write_table(arrowTable)
         else:
-            thisID = 'graph_' + str(countLine)
-
-        # for each meta line
-        for meta in graph.json_data()["meta"]:
-            attValDict = {} # init dict for att-val pairs
-            for att in codingAtt:
-                attValDict[att] = '_'  # default value
-            if 'text_id' in graph.json_data()["meta"].keys():
-                attValDict["text_id"] = graph.json_data()["meta"]['text_id']
-            if args.html:  # add a column for URLs pointing to corpus on server
-                if args.html_file:  # specific html file
-                    url = '=HYPERLINK(\"{}/{}/{}#{}\"; \"WWW\")'.format(htmlServer, htmlDir, args.html_file, graph.json_data()["meta"]['sent_id'])
-                else:          # default: name of html file is text_id
-                    url = '=HYPERLINK(\"{}/{}/{}#{}\"; \"WWW\")'.format(htmlServer, htmlDir, graph.json_data()["meta"]['text_id'], graph.json_data()["meta"]['sent_id'])
-                attValDict["url"]  = url
-            if 'text' in graph.json_data()["meta"].keys():
-                attValDict["text"] = graph.json_data()["meta"]['text']
-            if 'date' in graph.json_data()["meta"].keys():
-                attValDict["date"] = graph.json_data()["meta"]['date']
-            attValDict["sent_id"] = thisID
-            if re.search(reCoding, meta):
-                codeNr = re.search(reCoding, meta).group(1)
-                codeStr = graph.json_data()['meta'][meta]
-                # split att-value pairs and store in att-value dictionary
-                pairs = codeStr.split(';')
-                attValDict["node"] = codeNr
-                for pair in pairs:
-                    if pair.count('=') == 1:
-                        attribute, value = pair.split('=')
-                    else:
-                        attribute = pair[:pair.find('=')]
-                        value = pair[pair.find('='):] + "_ERROR"
-                        print(f"  WARNING: pair {pair} is not well formed")
-                    if attribute in codingAtt:   # only if in pre-defined columns
-                        if args.keep_target_node_info:
-                            value = re.sub(r'\(.*', '', value)
-                        attValDict[attribute] = value
-                    else:               
-                        print(f"  WARNING: skipping undefined attribute in pair: '{pair}'")
-                outRows[codeNr] = attValDict  # temporarily store in dict
-        # print row for numerically sorted nodes
-        sorted_keys = sorted(outRows.keys(), key=lambda x: int(x))
-        for key in outRows:
-            values = [str(value) for value in outRows[key].values()]
-            row = '\t'.join(values) + '\n'
-            out.write(row)
+            table['parts'].append(arrowTable)
     print("Done.")
+
+def closeTable(table):
+    # finish the coding table (parquet and feather files are also written if there were no rows)
+    if table['format'] == 'tsv':
+        table['file'].close()
+        return
+    import pyarrow, pyarrow.parquet, pyarrow.feather
+    if table['format'] == 'parquet':
+        if table['writer'] is None:
+            table['writer'] = pyarrow.parquet.ParquetWriter(table['name'], pyarrow.schema([(att, pyarrow.string()) for att in codingAtt]))
+        table['writer'].close()
+    else:
+        if table['parts']:
+            arrowTable = pyarrow.concat_tables(table['parts'])
+        else:
+            arrowTable = pyarrow.table({att: pyarrow.array([], type=pyarrow.string()) for att in codingAtt})
+        pyarrow.feather.write_feather(arrowTable, table['name'])
+
+def mergeTables(tableFiles, fileName):
+    # options --batch, --serve: merge the per-file coding tables to fileName
+    #   tsv: concatenated with the header of the first file only, parquet/feather: columns are unified
+    if tableFormat(fileName) == 'tsv':
+        with openFile(partName(fileName), 'w', newline='') as out:
+            for nr, tableFile in enumerate(tableFiles):
+                with openFile(tableFile, 'r', newline='') as input:
+                    header = input.readline()
+                    if nr == 0:
+                        out.write(header)
+                    for line in input:
+                        out.write(line)
+        commitPart(fileName)
+        return
+    import pyarrow, pyarrow.parquet, pyarrow.feather
+    read = pyarrow.parquet.read_table if tableFormat(fileName) == 'parquet' else pyarrow.feather.read_table
+    tables = [read(tableFile) for tableFile in tableFiles]
+    if tables:
+        merged = pyarrow.concat_tables(tables, promote_options='default')
+    else:
+        merged = pyarrow.table({})
+    if tableFormat(fileName) == 'parquet':
+        pyarrow.parquet.write_table(merged, partName(fileName))
+    else:
+        pyarrow.feather.write_feather(merged, partName(fileName))
+    commitPart(fileName)
     return()
 
+# option -c: column names of the compared tables
+compareRenameUD = {'text':'textid', 'pobj_agent':'pobj'}
+compareRenameCS = {'reflself':'refl', 'ipType':'clause'}
+# option -c: normalization of the compared tables, per column: (regex, replacement), applied in this order
+#   '*' applies to all columns used in the comparison (join key and compared columns)
+compareNormUD = {   # UD coding table (input file)
+    'textid': [(r'#', '')],
+    'subj': [(r'pred', ''),   # copulas: e.g. predpro > pro
+             (r'pass', '')],  # passive: e.g. passpro > pro
+    '*': [(r'_', '0'), (r'=', '')],
+}
+compareNormCS = {   # CorpusSearch coding table (argument of -c)
+    'textid': [(r'_\d+$', '')],
+    'subj': [(r'proimp', 'pro'), (r'nullcon|nullpro', '0')],
+    'dobj': [(r'prd', 'pred'), (r'clit.*', 'pro'), (r'lex-trace', 'pro'), (r'quant', 'lex')],
+}
+compareChunkSize = 100000   # option --compare_partitions: rows read at a time
+
+def compareKeys():
+    # compared columns and join key columns of the two tables (options --compare_columns, --compare_key)
+    columns = [c for c in args.compare_columns.split(',') if c]
+    keys = args.compare_key.split(':')
+    return(columns, keys[0].split(','), keys[-1].split(','))
+
+def prepareTable(df, keyColumns, columns, renames, normMap, fileName):
+    # make a table compatible: rename, keep the key and compared columns, normalize them
+    df = df.rename(columns=renames)
+    used = list(dict.fromkeys(keyColumns + columns))
+    missing = [c for c in used if c not in df.columns]
+    if missing:
+        sys.exit(f"ERROR: columns {missing} not found in {fileName}")
+    return(normalizeColumns(df[used].copy(), used, normMap))
+
+def normalizeColumns(df, columns, normMap):
+    # apply the normalization map to the given columns only (one vectorized replace per column and rule)
+    for column in columns:
+        for pattern, replacement in normMap.get(column, []) + normMap.get('*', []):
+            df[column] = df[column].replace({pattern: replacement}, regex=True)
+        df[column] = df[column].fillna('0').astype(str)  # because 'null' is imported as 'NaN'
+    return(df)
+
+def keyString(df, keyColumns):
+    # join key without occurrence number: the key columns separated by '_'
+    key = df[keyColumns[0]]
+    for column in keyColumns[1:]:
+        key = key + '_' + df[column]
+    return(key)
+
+def joinKey(df, keyColumns):
+    # join key: key columns and the occurrence number of this combination (a verb form occurring twice in a text)
+    return(keyString(df, keyColumns) + '_' + df.groupby(keyColumns, sort=False).cumcount().astype(str))
+
+def joinTables(df1, df2, columns, key1, key2):
+    # merge the prepared tables on the join key and add the match scores of each compared column
+    df1['join'] = joinKey(df1, key1)
+    df2['join'] = joinKey(df2, key2)
+    merged_df = pd.merge(df1[['join'] + columns], df2[['join'] + columns], on='join', suffixes=('_1', '_2'))
+    merged_df['cmp_sum'] = 0
+    for column in columns:
+        merged_df[f'cmp_{column}'] = merged_df[f'{column}_1'].eq(merged_df[f'{column}_2']).astype(int)
+        merged_df['cmp_sum'] += merged_df[f'cmp_{column}']
+    return(merged_df)
+
+def pairCounts(df, column):
+    # confusion counts of a compared column: number of rows for each (UD value, CorpusSearch value)
+    return(df.groupby([f'{column}_1', f'{column}_2']).size())
+
 def compareTable(df1, df2):
     # compare this table to the input file table
     # df1 = conll coding
     # df2 = mcvf coding  (argument of -c)
-    print(f"Comparing tables...")
-    columns_to_compare = ['join', 'clause', 'subj', 'dobj', 'iobj'] # , 'pobj', 'refl'
-    # make df1 compatible: rename and replace
-    df1 = df1.rename(columns={'text':'textid', 'pobj_agent':'pobj'})
-    df1['textid'] = df1['textid'].replace({'#':'', 'TEST':'TEST'}, regex=True)
-    df1['subj'] = df1['subj'].replace({'pred':''}, regex=True)  # copulas: e.g. predpro > pro
-    df1['subj'] = df1['subj'].replace({'pass':''}, regex=True)  # passive: e.g. passpro > pro
-    df1 = df1.replace({'_':'0'}, regex=True)
-    df1 = df1.replace({'=':''}, regex=True)
-    df1 = df1.fillna('0')  # because 'null' is imported as 'NaN'
-    # make df2 compatible
-    df2 = df2.rename(columns={'reflself':'refl','ipType':'clause'})
-    df2['textid'] = df2['textid'].replace({'_\d+$':''}, regex=True)
-    df2 = df2.drop(columns=['URLwww', 'URLlok', ], errors='ignore')
-    df2['subj'] = df2['subj'].replace({'proimp':'pro'}, regex=True)
-    df2['subj'] = df2['subj'].replace({'nullcon|nullpro':'0'}, regex=True)
-    df2['dobj'] = df2['dobj'].replace({'prd':'pred'}, regex=True)
-    df2['dobj'] = df2['dobj'].replace({'clit.*':'pro'}, regex=True)
-    df2['dobj'] = df2['dobj'].replace({'lex-trace':'pro'}, regex=True)
-    df2['dobj'] = df2['dobj'].replace({'quant':'lex'}, regex=True)
-    # make a join key with textid and verbform (this won't work if a verb occurs twice)
-    df1['join'] = df1['textid'] + '_' + df1['textform']
-    df2['join'] = df2['textid'] + '_' + df2['form']
+    #   columns and join key: options --compare_columns, --compare_key
+    print("Comparing tables...")
+    columns, key1, key2 = compareKeys()
+    df1 = prepareTable(df1, key1, columns, compareRenameUD, compareNormUD, args.file_name)
+    df2 = prepareTable(df2, key2, columns, compareRenameCS, compareNormCS, args.compare_table)
     print(df1.head())
     print(df2.head())
-    # Merge DataFrames on 'textid' to compare specified columns
-    merged_df = pd.merge(df1[columns_to_compare], df2[columns_to_compare], on='join', suffixes=('_1', '_2'))
-    # Iterate through the columns and update the match scores
-    merged_df['cmp_sum'] = 0
-    scoreColumns = columns_to_compare
-    scoreColumns.remove('join')
-    for column in scoreColumns:
-        merged_df['cmp_sum'] += (merged_df[f'{column}_1'] == merged_df[f'{column}_2']).astype(int)
-    for column in ['subj', 'dobj', 'iobj']:
-        merged_df[f'cmp_{column}'] = merged_df[f'{column}_1'].eq(merged_df[f'{column}_2']).astype(int)
-    # Add a bottom line for scores
-    total_rows = len(merged_df)
-    evalColumns = ['cmp_subj', 'cmp_dobj', 'cmp_iobj']
-    # Create a new DataFrame with the column sums
-    columnSums = (merged_df[evalColumns].sum()/total_rows).round(2)  # .sum() creates a pandas series
-    sumRow = pd.DataFrame([columnSums.values], columns=evalColumns, index=['Sum'])
-    # Display the DataFrame with match scores
-    print(f"\n--------> Results subj:\n{sumRow}")
-    new_df = pd.concat([sumRow, merged_df])
-    errorStats(merged_df, "subj_1", "subj_2")
-    print(f"\n--------> Results dobj:\n{sumRow}")
+    merged_df = joinTables(df1, df2, columns, key1, key2)
+    print(f"{len(merged_df)} rows matched ({len(df1)} in {args.file_name}, {len(df2)} in {args.compare_table})")
+    counts = {column: pairCounts(merged_df, column) for column in columns}
+    sumRow = compareScores(counts, len(merged_df))
     new_df = pd.concat([sumRow, merged_df])
-    errorStats(merged_df, "dobj_1", "dobj_2")
     return(new_df)
 
-def errorStats (df, col1, col2):
-    mismatch_dict = {}
-    # Iterate through rows and compare values in the specified columns
-    for index, row in df.iterrows():
-        value1 = row[col1]
-        value2 = row[col2]
-        if value1 != value2:
-            mismatch_pair = (value1, value2)  # a tuple, used as key in our dict
-            mismatch_dict[mismatch_pair] = mismatch_dict.get(mismatch_pair, 0) + 1
-    # sort and print the frequencies of mismatching pairs
-    sorted_mismatches = dict(sorted(mismatch_dict.items(), key=lambda x: x[1], reverse=True))
+def compareTableStream(fileName1, fileName2, outFile):
+    # option --compare_partitions: compare tables larger than memory
+    #   pass 1: read the tables in chunks and hash-partition the rows on the join key into temporary files
+    #   pass 2: join the tables partition by partition, add up the confusion counts, append the rows to a temporary file
+    #   the output (score row first) is written at the end
+    print(f"Comparing tables in {args.compare_partitions} partitions...")
+    columns, key1, key2 = compareKeys()
+    nrParts = args.compare_partitions
+    tmpDir = tempfile.mkdtemp(prefix='ud-compare-', dir=os.path.dirname(os.path.abspath(outFile)))
+    nrRows = [0, 0]
+    for side, fileName, keyColumns, renames, normMap in [(0, fileName1, key1, compareRenameUD, compareNormUD),
+                                                         (1, fileName2, key2, compareRenameCS, compareNormCS)]:
+        parts = [open(os.path.join(tmpDir, f'{side}.{n}.tsv'), 'w', newline='') for n in range(nrParts)]
+        input = openFile(fileName, 'r')
+        for chunk in pd.read_csv(input, delimiter='\t', dtype=str, chunksize=compareChunkSize):
+            chunk = prepareTable(chunk, keyColumns, columns, renames, normMap, fileName)
+            nrRows[side] += len(chunk)
+            # all rows of a key go to the same partition, in the order of the table (for the occurrence number)
+            partition = pd.util.hash_pandas_object(keyString(chunk, keyColumns), index=False) % nrParts
+            for n, rows in chunk.groupby(partition, sort=False):
+                rows.to_csv(parts[n], sep='\t', index=False, header=parts[n].tell() == 0)
+        input.close()
+        for part in parts:
+            part.close()
+    counts = {column: [pairCounts(pd.DataFrame(columns=[f'{column}_1', f'{column}_2']), column)] for column in columns}
+    outColumns = [f'cmp_{column}' for column in columns] + ['join'] + [f'{column}_1' for column in columns] \
+        + [f'{column}_2' for column in columns] + ['cmp_sum']
+    nrMatched = 0
+    rowFile = os.path.join(tmpDir, 'rows.tsv')
+    with open(rowFile, 'w', newline='') as rowOutput:
+        for n in range(nrParts):
+            partFiles = [os.path.join(tmpDir, f'{side}.{n}.tsv') for side in [0, 1]]
+            if os.path.getsize(partFiles[0]) == 0 or os.path.getsize(partFiles[1]) == 0:
+                continue
+            df1, df2 = [pd.read_csv(partFile, delimiter='\t', dtype=str, keep_default_na=False) for partFile in partFiles]
+            merged_df = joinTables(df1, df2, columns, key1, key2)
+            nrMatched += len(merged_df)
+            for column in columns:
+                counts[column].append(pairCounts(merged_df, column))
+            scoreColumns = ['cmp_sum'] + [f'cmp_{column}' for column in columns]
+            merged_df[scoreColumns] = merged_df[scoreColumns].astype(float)  # as in the output of compareTable
+            merged_df[outColumns].to_csv(rowOutput, sep='\t', index=False, header=False)
+    print(f"{nrMatched} rows matched ({nrRows[0]} in {fileName1}, {nrRows[1]} in {fileName2})")
+    counts = {column: pd.concat(counts[column]).groupby(level=[0, 1]).sum() for column in columns}
+    sumRow = compareScores(counts, nrMatched)
+    print(f"Writing merged table to file {outFile}")
+    with openFile(outFile, 'w', newline='') as output:
+        sumRow.reindex(columns=outColumns).to_csv(output, sep='\t', index=False)
+        with open(rowFile, 'r') as rows:
+            shutil.copyfileobj(rows, output)
+    shutil.rmtree(tmpDir)
+    return()
+
+def compareScores(counts, nrRows):
+    # print accuracy, mismatches and precision/recall/F1 from the confusion counts of each compared column
+    #   returns the score row (accuracy) of the merged table
+    columns = list(counts)
+    evalColumns = [f'cmp_{column}' for column in columns]
+    accuracy = [sameValues(counts[column]).sum() / max(nrRows, 1) for column in columns]
+    sumRow = pd.DataFrame([accuracy], columns=evalColumns, index=['Sum']).round(2)
+    print(f"\n--------> Accuracy:\n{sumRow}")
+    scores = []
+    for column in columns:
+        print(f"\n--------> Results {column}:")
+        errorStats(counts[column], f"{column}_1", f"{column}_2")
+        scores.append(valueScores(counts[column], f"{column}_1", f"{column}_2").assign(column=column))
+    scores = pd.concat(scores)[['column', 'value', 'tp', 'ud', 'cs', 'precision', 'recall', 'f1']]
+    if args.compare_scores:
+        print(f"Writing scores to file {args.compare_scores}")
+        scores.to_csv(args.compare_scores, sep='\t', index=False)
+    return(sumRow)
+
+def sameValues(counts):
+    # the counts of matching pairs (diagonal of the confusion counts)
+    return(counts[counts.index.get_level_values(0) == counts.index.get_level_values(1)])
+
+def errorStats (counts, col1, col2):
+    # print the frequencies of mismatching pairs, from the confusion counts of the two columns
+    pairs = counts[counts.index.get_level_values(0) != counts.index.get_level_values(1)]
     print(f">>>> {col1}-{col2} mismatches:")
-    for pair, frequency in sorted_mismatches.items():
+    for pair, frequency in pairs.sort_values(ascending=False, kind='stable').items():
         print(f"\t{frequency}\t{pair}")
 
+def valueScores (counts, col1, col2):
+    # precision, recall and F1 of each value, col1 = UD coding, col2 = CorpusSearch coding (reference)
+    counts = pd.DataFrame({
+        'tp': sameValues(counts).groupby(level=0).sum(),
+        'ud': counts.groupby(level=0).sum(),
+        'cs': counts.groupby(level=1).sum()}).fillna(0).astype(int)
+    precision = (counts['tp'] / counts['ud']).fillna(0)
+    recall = (counts['tp'] / counts['cs']).fillna(0)
+    counts['precision'] = precision.round(3)
+    counts['recall'] = recall.round(3)
+    counts['f1'] = (2 * precision * recall / (precision + recall)).fillna(0).round(3)
+    counts = counts.rename_axis('value').reset_index()
+    print(f">>>> {col1}-{col2} scores:")
+    print(counts.to_string(index=False))
+    return(counts)
+
+# render the tree of a sentence directly from the token list
+def htmlDots (value):
+    # runs of dots in a value are marked like indentation dots (as in tree_to_html)
+    value = str(value)
+    if '..' in value:
+        return(re.sub(r'(\.\.+)', r'<span class=dot>\1</span> ', value))
+    return(value)
+
+def treeHTML (tokens):
+    # convert the tree of a sentence (conllu TokenList) to HTML, one line per word in word order:
+    #   number, indentation dots for the depth, form, lemma, upos, xpos, deprel and head (same markup as tree_to_html)
+    #   returns None unless the words form a tree with a single root (see printTree)
+    words = [token for token in tokens if isinstance(token['id'], int)]   # no multi-word tokens, empty nodes
+    children = defaultdict(list)
+    for token in words:
+        children[token['head']].append(token['id'])
+    if len(children[0]) != 1:
+        return(None)
+    depth = {}
+    stack = [(children[0][0], 0)]
+    while stack:
+        wID, d = stack.pop()
+        depth[wID] = d
+        stack += [(child, d + 1) for child in children[wID]]
+    if len(depth) != len(words):   # words not connected to the root
+        return(None)
+    html = []
+    for token in sorted(words, key=lambda token: token['id']):
+        d = depth[token['id']]
+        upos = str(token['upos'])
+        html.append('%02d%s <b>%s</b> <span class=l>%s</span> <span class=%s>%s</span> <span class=x>%s</span>  <span class=d>%s</span>&#8594;%s<br/>\n' % (
+            token['id'], '<span class=dot>' + '.' * 4 * d + '</span> ' if d > 0 else '',
+            htmlDots(token['form']), htmlDots(token['lemma']), 'v' if re.fullmatch(r'VER[A-Z]+', upos) else 'u', htmlDots(upos),
+            htmlDots(token['xpos']), htmlDots(token['deprel']), token['head']))
+    html.append('<br/>')
+    return(''.join(html))
+
+# fallback for treeHTML: the print_tree() output of conllu as a string, converted by tree_to_html
+printTreeExclude = ('id', 'deprel', 'xpos', 'feats', 'head', 'deps', 'misc')  # fields not printed by print_tree()
+def printTree (tree, depth=0):
+    # returns the lines of print_tree() for a conllu TokenTree
+    nodeRepr = ' '.join('{}:{}'.format(key, value) for key, value in tree.token.items() if not key in printTreeExclude)
+    lines = [' ' * 4 * depth + '(deprel:{}) {} [{}]'.format(tree.token['deprel'], nodeRepr, tree.token['id'])]
+    for child in tree.children:
+        lines += printTree(child, depth + 1)
+    return(lines)
+
+# convert the tree to HTML and add dependencies
+def tree_to_html(tree_str, xpos, deps):
+    lines = tree_str.strip().split("\n") # Split the tree string into lines
+    # sort lines based on word numbers (print_tree orders according to hierarchy, e.g. root in first line etc)
+    lines = sorted(lines, key=lambda line: int(re.search(r'\[(\d+)\]', line).group(1)))
+    # Convert each line to HTML node with proper indentation using dots
+    html_nodes = []
+
+    def repl(match):  # returns string for re.sub below
+        wID = int(match.group(1))  # Evaluate the variable or expression
+        return f"xpos:{xpos.get(wID, '')} [{wID}:{deps.get(wID, '')}]"  # return id:head, e.g.  [5:6]
+
+    for line in lines:
+        wID = re.search(r'\[(\d+)\]', line).group(1)
+        wID = int(wID)
+        line = re.sub(r'\[(\d+)\]', repl, line)
+        leading_spaces = len(line) - len(line.lstrip(' ')) # Count the number of leading spaces
+        indented_line = '.' * leading_spaces + line.lstrip() # Replace leading spaces with dots
+        # Convert indented line to HTML node
+        html_nodes.append("{}".format(indented_line))
+    html_branch = "{}<br/>".format("".join(html_nodes)) # format HTML nodes
+    html_tree = "{}".format(html_branch) # format the entire HTML branch
+
+    """
+    change tree format and insert html codes. Tree looks like this:
+    (deprel:root) form:souhaite lemma:souhaiter upos:VERB [3:0]
+        (deprel:cc) form:et lemma:et upos:CCONJ [1:3]
+    """
+    html_tree = re.sub(
+        r'(\.+)?\(deprel:(.*?)\)(.*?)\[(\d+):(\d+)\]',
+        lambda m: f"{int(m.group(4)):02d}{'' if m.group(1) is None else m.group(1)}{m.group(3)} <span class=d>{m.group(2)}</span>&#8594;{m.group(5)}<br/>\n",
+        html_tree
+    )
+    html_tree = re.sub(r'lemma:(.*?) ', r'<span class=l>\1</span> ', html_tree)
+    html_tree = re.sub(r'upos:(VER[A-Z]+) ', r'<span class=v>\1</span> ' , html_tree)
+    html_tree = re.sub(r'upos:(.*?) ', r'<span class=u>\1</span> ', html_tree)
+    html_tree = re.sub(r'xpos:(.*?) ', r'<span class=x>\1</span> ', html_tree)
+    html_tree = re.sub(r'form:(.*?) ', r'<b>\1</b> ', html_tree)
+    html_tree = re.sub(r'(\.\.+)', r'<span class=dot>\1</span> ', html_tree)
+
+    return html_tree
+
+def openHTML (outFile):
+    # create the HTML file for outFile in htmlDir and write the header
+    #   returns the open file and its name (see addIndexLink)
+    #   the HTML file is not compressed (browsers open it from index.html and the table URLs)
+    # make dir for HTML files
+    os.makedirs(htmlDir, exist_ok=True)
+    if not os.path.isdir(htmlDir):
+        print("Directory '%s' created\n" % htmlDir)
+
+    textCode = htmlFile = re.sub(r'.*/', '', plainName(outFile))
+    textCode = re.sub(r'.*/', '', textCode)  # strip path
+    textCode = re.sub(r'\..*', '', textCode)  # strip suffix
+    htmlFile = re.sub('conllu', 'html', htmlFile)
+    print(f"Writing HTML output to {htmlFile}...")
+
+    out = open(partName(htmlDir + '/' + htmlFile), 'w', buffering=writeBuffer)
+    out.write(htmlHead % textCode + '\n\n')
+    return(out, htmlFile)
+
+def closeHTML (out):
+    # write the foot of the HTML file and close it
+    out.write(htmlFoot + '\n')
+    out.close()
+
+def addIndexLink (htmlFile):
+    # add a link to htmlFile to index.html
+    #  create index.html unless it exists
+    if not os.path.isfile(htmlDir+'/index.html'):
+        with open(htmlDir+'/index.html', 'w') as file:
+            file.write(htmlHead + '\n\n')
+            file.write(htmlSource + '\n\n<br/>')
+    # add link to this file
+    with open(htmlDir+'/index.html', 'a') as file:
+        file.write('<br/>\n<a href="%s">%s</a>' % (htmlFile, htmlFile))  # add link to index file
+
+def writeHTML (out, codedCONLLU):
+    # write the HTML version of a list of coded CoNLL-U strings to the open HTML file out
+    from conllu import parse
+    for conll in codedCONLLU:   # parsed one by one: one TokenList in memory
+        for sentence in parse(conll):
+            out.write(sentenceHTML(sentence))
+
+def sentenceHTML (sentence):
+    # the HTML version of a sentence (conllu TokenList): anchor, metadata, text, codings and tree
+    # retrieve metadata entries
+    metadata = sentence.metadata
+    sCode = metadata['sent_id']
+    bib = ''  # add metadata to the output
+    if 'author' in metadata:
+        bib = "{}{}:".format(bib, metadata["author"])
+    if 'title' in metadata:
+        bib = "{} <i>{}</i>".format(bib, metadata["title"])
+    if 'date' in metadata:
+        bib = "{} ({})".format(bib, metadata["date"])
+    if bib != '':
+        bib = "{}<br/>\n".format(bib)
+    # add coding metadata: Iterate over metadata dict
+    coding_lines = []
+    for key, value in metadata.items():
+        if key.startswith('coding_'):
+            nr = re.sub(r'coding_', '', key)
+            value = re.sub(r'(lemma|upos|xpos)=.*?;', r'', value)
+            value = re.sub(r'textform=(.*?);', r'<b>\1</b>: ', value)
+            value = re.sub(r';', r'; ', value)
+            value = re.sub(r' (.*?)=', r' <span class=a>\1</span>=', value)
+            coding_lines.append(nr + ': ' + value)
+    # sort lines numerically by coding numbers (coding_9 etc) and join
+    coding_lines = sorted(coding_lines, key=lambda x: int(x.split(':')[0]))
+    print_codings = '<br/>\n'.join(coding_lines)
+
+    clean = []
+    for token in sentence:  # loop through words in sentence
+        if str(token["xpos"]).startswith('V'):  # highlight verbs
+            clean.append('<span class=v>' + token["form"] + '</span>')
+        else:
+            clean.append(token["form"])  # for printed plain text
+    sprint = " ".join(clean)  # the tokens
+    sprint = re.sub(r' ([,:;\.\!\?])', r'\1', sprint)
+    sprint = re.sub('\' ', '\'', sprint)
+    sparsed = treeHTML(sentence)  # convert the tree to HTML
+    if sparsed is None:   # several roots etc.: print_tree() format of the conllu tree, converted with regexes
+        xpos = {token["id"]: token["xpos"] for token in sentence}  # store xpos (the original Frantext pos tag in col 5)
+        deps = {token["id"]: token["head"] for token in sentence}  # store id-head relations
+        sparsed = tree_to_html('\n'.join(printTree(sentence.to_tree())) + '\n', xpos, deps)
+
+    # print HTML
+    printOutput = '\n<a name=\"%s\"></a><hr>\n<h3>%s</h3>\n<font color="Sienna">%s</font>\n%s\n\n<p class="coding">%s</p>\n\n<p><div class=\"parse\"><p>%s</em></p></div>\n' % (sCode, sCode, bib, sprint, print_codings, sparsed)
+    return(printOutput)
+
+# -------------------------------------------------------
+# paginated HTML (option --html_page_size)
+# -------------------------------------------------------
+def pageName (base, nr):
+    # file name of page nr (from 1)
+    return('%s-%03d.html' % (base, nr))
+
+def openPages (outFile):
+    # option --html_page_size: paginated HTML version of outFile in htmlDir, pages <name>-001.html, <name>-002.html...
+    #   sentence n of the file is on page (n-1) // html_page_size + 1, in all runs
+    #   returns the state of the pages (see writePages, closePages) and the name of the first page (see addIndexLink)
+    os.makedirs(htmlDir, exist_ok=True)
+    htmlFile = re.sub('conllu', 'html', re.sub(r'.*/', '', plainName(outFile)))   # the pages are not compressed
+    base = re.sub(r'\.html$', '', htmlFile)
+    print(f"Writing HTML output to {base}-*.html ({args.html_page_size} sentences per page)...")
+    pages = {
+        'base': base,
+        'title': re.sub(r'\..*', '', htmlFile),  # strip suffix
+        'out': None,        # open page
+        'files': [],        # page files
+        'sentences': {},    # sent_id -> page number
+        'lemmas': defaultdict(list),   # lemma -> sent_ids
+        'codings': defaultdict(list),  # att=val -> sent_ids
+        }
+    return(pages, pageName(base, 1))
+
+def pageLinks (pages, nr, next):
+    # navigation of page nr: previous page, next page (if next), search page and index
+    links = []
+    if nr > 1:
+        links.append('<a href="%s">&lt; page %d</a>' % (pageName(pages['base'], nr - 1), nr - 1))
+    links.append('page %d' % nr)
+    if next:
+        links.append('<a href="%s">page %d &gt;</a>' % (pageName(pages['base'], nr + 1), nr + 1))
+    links.append('<a href="search.html?index=%s.index.json">search</a>' % pages['base'])
+    links.append('<a href="index.html">List of files</a>')
+    return('<p>%s</p>\n' % ' | '.join(links))
+
+def closePage (pages, next):
+    # write the foot of the open page
+    pages['out'].write(pageLinks(pages, len(pages['files']), next) + htmlFoot + '\n')
+    pages['out'].close()
+    pages['out'] = None
+    commitPart(htmlDir + '/' + pages['files'][-1])
+
+def writePages (pages, codedCONLLU):
+    # option --html_page_size: write the HTML version of a list of coded CoNLL-U strings to the pages
+    #   and collect the sentences, lemmas and codings for the JSON index
+    from conllu import parse
+    for sentence in (sentence for conll in codedCONLLU for sentence in parse(conll)):
+        nr = len(pages['sentences']) // args.html_page_size + 1
+        if nr > len(pages['files']):   # start a new page
+            if pages['out'] is not None:
+                closePage(pages, True)
+            pages['files'].append(pageName(pages['base'], nr))
+            pages['out'] = open(partName(htmlDir + '/' + pages['files'][-1]), 'w', buffering=writeBuffer)
+            pages['out'].write(htmlHead % ('%s, page %d' % (pages['title'], nr)) + '\n\n' + pageLinks(pages, nr, False))
+        sCode = sentence.metadata['sent_id']
+        pages['sentences'][sCode] = nr
+        htmlPages[sCode] = pages['files'][-1]
+        for lemma in sorted(set(str(token['lemma']) for token in sentence if isinstance(token['id'], int))):
+            pages['lemmas'][lemma].append(sCode)
+        codings = set()
+        for key, value in sentence.metadata.items():
+            if key.startswith('coding_'):
+                for pair in value.split(';'):
+                    if pair.count('=') == 1 and not pair.split('=')[0] in ['textform', 'lemma', 'upos', 'xpos']:
+                        codings.add(pair.split('(')[0])   # without target node info
+        for coding in sorted(codings):
+            pages['codings'][coding].append(sCode)
+        pages['out'].write(sentenceHTML(sentence))
+
+def closePages (pages):
+    # option --html_page_size: close the last page, write the JSON index <name>.index.json and the search page
+    #   index: sent_id -> page number, page files, lemma -> sent_ids, att=val -> sent_ids
+    if pages['out'] is not None:
+        closePage(pages, False)
+    index = {
+        'title': pages['title'],
+        'page_size': args.html_page_size,
+        'pages': pages['files'],
+        'sentences': pages['sentences'],
+        'lemmas': pages['lemmas'],
+        'codings': pages['codings'],
+        }
+    with open(partName(htmlDir + '/' + pages['base'] + '.index.json'), 'w') as out:
+        json.dump(index, out, ensure_ascii=False, separators=(',', ':'))
+    commitPart(htmlDir + '/' + pages['base'] + '.index.json')
+    with open(htmlDir + '/search.html', 'w') as out:
+        out.write(htmlSearch)
+
+def codeFile (inFile, outFile, tableFile, requestDict):
+    # code one CoNLL-U file: write the coded CoNLL-U to outFile, the coding table to tableFile (if any)
+    #   and the HTML version (option -H)
+    #   returns the number of coded graphs and the name of the HTML file (None without -H)
+    global codingAtt, htmlPages
+    codingAtt = []  # table columns are collected for each file
+    htmlPages = {}
+    # options --chunk_size, --batch, --serve: the table header is written after the first chunk, so all columns are declared here
+    if args.chunk_size > 0 or args.batch or args.serve:
+        declareCodingAtt(requestDict)
+
+    # code the corpus chunk by chunk (one chunk = whole file by default) and write the output of each chunk
+    #   option --async_output: CoNLL-U, HTML and table are written by background threads (see OutputWriter)
+    #   option --splice: the input is copied to the output (source), with the new meta lines inserted
+    #   compressed files (see openFile) are read and written chunk by chunk as well
+    if args.splice:
+        input = openFile(inFile, 'rb')
+        out = openFile(partName(outFile), 'wb', buffering=writeBuffer)
+        source = openFile(inFile, 'rb')
+        spliceSource = openFile(inFile, 'rb') if args.html else None   # read by spliceText in this thread
+        chunks = readSpliceChunks(input, args.chunk_size)
+    else:
+        input = openFile(inFile, 'r')
+        out = openFile(partName(outFile), 'w', buffering=writeBuffer)   # output corpus as CoNLL-U
+        chunks = ((data, None) for data in readChunks(input, args.chunk_size))
+        if args.sidecar and args.chunk_size <= 0:   # the text is read by codeChunk, only if it is needed
+            chunks = [(None, None)]
+    conllWriter, htmlWriter, tableWriter = [OutputWriter(name, args.async_output) for name in ['conllu', 'html', 'table']]
+    htmlOut = tableOut = htmlFile = None
+    nrGraphs = nrChunks = 0
+    for data, sentences in chunks:
+        nrChunks += 1
+        if args.chunk_size > 0:
+            print(f"------- Chunk {nrChunks}: sentences from {nrGraphs + 1}")
+        codedCorpus, sorted_keys = codeChunk(data, requestDict, nrGraphs, inFile)
+        del data
+        nrGraphs += len(sorted_keys)
+
+        # the CoNLL-U strings are made in this thread: grew calls are not thread-safe
+        start = time.perf_counter()
+        print(f"Writing the output to {outFile}...\n", end='')
+        if sentences is not None:   # option --splice: only the meta lines are made, in input order
+            spliced = spliceChunk(sentences, codedCorpus)
+            codedCONLLU = spliceText(spliceSource, spliced) if args.html else []
+            profilePhase('write', start)
+            conllWriter.put('write', writeSplice, out, source, spliced)
+            del sentences, spliced
+        else:
+            codedCONLLU = [codedCorpus[key].to_conll() for key in sorted_keys]  # store coded conllu for HTML export
+            profilePhase('write', start)
+            conllWriter.put('write', writeCONLLU, out, codedCONLLU)
+
+        # create a HTML version of the output
+        htmlDone = None
+        if args.html:
+            if args.html_page_size > 0:   # paginated
+                if htmlOut is None:
+                    htmlOut, htmlFile = openPages(outFile)
+                htmlDone = htmlWriter.put('html', writePages, htmlOut, codedCONLLU)
+            else:
+                if htmlOut is None:
+                    htmlOut, htmlFile = openHTML(outFile)
+                htmlWriter.put('html', writeHTML, htmlOut, codedCONLLU)
+        del codedCONLLU
+
+        # output coding table as tsv
+        #   --html_page_size: the table URLs need the pages of the chunk (htmlDone)
+        if tableFile != '':
+            if tableOut is None:
+                tableOut = openTable(tableFile)
+            tableWriter.put('table', writeTable, tableOut, [codedCorpus[key] for key in sorted_keys], graphCodings, after=htmlDone)
+    input.close()
+    if args.splice:   # the rest of the input after the last sentence
+        conllWriter.put('write', shutil.copyfileobj, source, out)
+        conllWriter.put('write', source.close)
+        if spliceSource is not None:
+            spliceSource.close()
+    conllWriter.put('write', out.close)
+    if htmlOut is not None:
+        htmlWriter.put('html', closePages if args.html_page_size > 0 else closeHTML, htmlOut)
+    if tableOut is not None:
+        tableWriter.put('table', closeTable, tableOut)
+    closeWriters([conllWriter, htmlWriter, tableWriter])
+    # option --manifest: the complete outputs replace the old ones
+    commitPart(outFile)
+    if tableOut is not None:
+        commitPart(tableFile)
+    if htmlOut is not None and args.html_page_size <= 0:
+        commitPart(htmlDir + '/' + htmlFile)
+    print(f"Codings written for {nrGraphs} graphs.")
+    return(nrGraphs, htmlFile)
+
+def writeCONLLU (out, codedCONLLU):
+    # write a list of coded CoNLL-U strings to the open file out
+    out.write(''.join(conll + '\n' for conll in codedCONLLU))
+
+# -------------------------------------------------------
+# splice output (option --splice)
+# -------------------------------------------------------
+'''
+The coding only adds meta lines (coding_<node>, and sent_id, text with -C).
+Instead of serializing each graph with to_conll(), the output is a copy of the input bytes,
+with the meta lines of each sentence replaced by spliceMeta(). Token lines are never rewritten.
+The sentences of a chunk are the graphs of the CorpusDraft in input order.
+'''
+def spliceMeta (metaLines, meta):
+    # the meta lines of a coded sentence: metaLines = the meta lines of the input, meta = the meta data of the coded graph
+    #   coding_<node> lines are replaced if the coding has changed, new codings are appended
+    #   option -C: the added sent_id and text are appended (a comment line without '=' becomes the text)
+    newline = '\r\n' if len(metaLines) > 0 and metaLines[0].endswith('\r\n') else '\n'
+    lines = []
+    found = set()
+    for line in metaLines:
+        body = line[1:].strip()
+        key, value = [x.strip() for x in body.split('=', 1)] if '=' in body else ('', body)
+        found.add(key)
+        if key == '' and key not in meta:   # -C: renamed to text
+            continue
+        if key.startswith('coding_') and key in meta and meta[key] != value:
+            line = f"# {key} = {meta[key]}{newline}"
+        lines.append(line)
+    for key, value in meta.items():
+        if key not in found and (key.startswith('coding_') or key in ['sent_id', 'text']):
+            lines.append(f"# {key} = {value}{newline}")
+    return(''.join(lines))
+
+def metaSentID (metaLines):
+    # the sent_id in the meta lines of a sentence (None if there is none)
+    for line in metaLines:
+        body = line[1:].strip()
+        if '=' in body and body.split('=', 1)[0].strip() == 'sent_id':
+            return(body.split('=', 1)[1].strip())
+    return(None)
+
+def spliceChunk (sentences, codedCorpus):
+    # the sentences of a chunk (see readSpliceChunks) with their new meta lines: list of (start, metaEnd, end, meta lines)
+    #   each sentence gets the graph of the sent_id in its meta lines
+    #   sentences without sent_id get the graph at their position in file order (see draftOrder)
+    keys = draftOrder(codedCorpus)
+    if len(keys) != len(sentences):
+        raise ValueError(f"--splice: {len(sentences)} sentences in the input, but {len(keys)} graphs (repeated sent_id?)")
+    spliced = []
+    for (start, metaEnd, end, metaLines), key in zip(sentences, keys):
+        thisID = metaSentID(metaLines)
+        if thisID is None:
+            thisID = key
+        elif thisID not in codedCorpus:
+            raise ValueError(f"--splice: sent_id {thisID} of the input is not in the corpus")
+        spliced.append((start, metaEnd, end, spliceMeta(metaLines, graphMeta(codedCorpus[thisID]))))
+    return(spliced)
+
+def writeSplice (out, source, spliced):
+    # copy the input (source) up to the end of the spliced sentences to out, with their new meta lines
+    #   both files are opened in binary mode, source is read sequentially (no seek: compressed input, see openFile)
+    for start, metaEnd, end, metaText in spliced:
+        out.write(source.read(start - source.tell()))   # blank lines before the sentence
+        source.read(metaEnd - start)   # the meta lines of the input
+        out.write(metaText.encode('utf-8'))
+        out.write(source.read(end - metaEnd))
+
+def spliceText (source, spliced):
+    # option -H: the coded sentences as CoNLL-U strings
+    #   source = the input, opened in binary mode and read sequentially (see writeSplice)
+    conll = []
+    for start, metaEnd, end, metaText in spliced:
+        source.read(metaEnd - source.tell())
+        conll.append(metaText + source.read(end - metaEnd).decode('utf-8').replace('\r\n', '\n'))
+    return(conll)
+
+# -------------------------------------------------------
+# output writers (option --async_output)
+# -------------------------------------------------------
+class OutputWriter:
+    # writes one output (CoNLL-U, HTML or table) with the jobs passed to put(), in this order
+    #   threaded: a background thread runs the jobs, put() only blocks if writeQueueSize jobs are waiting
+    #   otherwise put() runs the job at once
+    #   an error of a job is raised by closeWriters(), the following jobs are skipped
+    def __init__ (self, name, threaded):
+        self.name = name
+        self.error = None
+        self.thread = None
+        if threaded:
+            self.jobs = queue.Queue(maxsize=writeQueueSize)
+            self.thread = threading.Thread(target=self.run, name='writer-' + name, daemon=True)
+            self.thread.start()
+
+    def put (self, phase, function, *arguments, after=None):
+        # run function(*arguments) in the writer, the time is added to the profile phase
+        #   after: an event to wait for (returned by put() of another writer)
+        #   returns an event set when the job is done (None if not threaded)
+        if self.thread is None:
+            start = time.perf_counter()
+            function(*arguments)
+            profilePhase(phase, start)
+            return(None)
+        done = threading.Event()
+        self.jobs.put((phase, function, arguments, after, done))
+        return(done)
+
+    def run (self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            phase, function, arguments, after, done = job
+            try:
+                if after is not None:
+                    after.wait()
+                if self.error is None:
+                    start = time.perf_counter()
+                    function(*arguments)
+                    profilePhase(phase, start)
+            except Exception as e:
+                self.error = e
+            finally:
+                done.set()
+
+    def close (self):
+        # wait until all jobs are done
+        if self.thread is not None:
+            self.jobs.put(None)
+            self.thread.join()
+
+def closeWriters (writers):
+    # close the writers, then raise the first error of a job
+    for writer in writers:
+        writer.close()
+    for writer in writers:
+        if writer.error is not None:
+            raise RuntimeError(f"{writer.name} output: {type(writer.error).__name__}: {writer.error}") from writer.error
+
+def initWorker (workerArgs, requestDict, compiledRules, hashes, literals):
+    # initialize the globals of a pool worker (spawned processes only import the script)
+    global args, workerRequests, engineRules, ruleHashes, prefilterRules, profile
+    args = workerArgs
+    if args.profile != '':
+        profile = newProfile()
+    workerRequests = requestDict
+    engineRules = compiledRules
+    ruleHashes = hashes
+    prefilterRules = literals
+    importGrew()
+
+def batchJob (job):
+    # code one file of a batch (in a pool worker or in the main process)
+    #   returns the job, the number of graphs, the HTML file, an error message (None if ok)
+    #   and the profile of the job in a pool worker (option --profile, else None)
+    global profile
+    inFile, outFile, tableFile = job
+    print(f"------- {inFile}")
+    try:
+        nrGraphs, htmlFile = codeFile(inFile, outFile, tableFile, workerRequests)
+        error = None
+    except Exception as e:
+        nrGraphs, htmlFile, error = 0, None, f"{type(e).__name__}: {e}"
+    jobProfile = None
+    if profile is not None and multiprocessing.current_process().daemon:
+        jobProfile = profile
+        profile = newProfile()
+    return(job, nrGraphs, htmlFile, error, jobProfile)
+
+def outputBase (inFile):
+    # options --batch, --serve: the name of the outputs of inFile in directory args.out_file (without suffixes)
+    return(re.sub(r'\.[^.]*$', '', os.path.basename(plainName(inFile))))  # strip suffix
+
+def batchOutputs (inFile):
+    # options --batch, --serve: job for inFile with output file names in directory args.out_file
+    #   compressed input gives compressed output, with the same codec
+    base = outputBase(inFile)
+    outFile = os.path.join(args.out_file, base + '.coded.conllu' + compressionSuffix(inFile))
+    #   per-file tables have the format and compression of the -t table (tsv: suffix .csv)
+    suffix = '.csv' if tableFormat(args.table) == 'tsv' else os.path.splitext(plainName(args.table))[1]
+    tableFile = os.path.join(args.out_file, base + suffix + compressionSuffix(args.table)) if args.table != '' else ''
+    return((inFile, outFile, tableFile))
+
+def codeBatch (requestDict):
+    # option --batch: code all input files (*.conllu for directories), output goes to directory args.out_file
+    #   requests are parsed once and the files are distributed over --jobs worker processes
+    global workerRequests
+    inFiles = []
+    for name in args.file_name:
+        if os.path.isdir(name):
+            inFiles += sorted(itertools.chain(*[glob.glob(os.path.join(name, '*.conllu' + suffix)) for suffix in [''] + list(compressionSuffixes)]))
+        elif os.path.isfile(name):
+            inFiles.append(name)
+        else:
+            print("file not found", name)
+    # inputs with the same name in different directories (or codecs) would overwrite each other's outputs
+    inFiles = list(dict.fromkeys(os.path.normpath(inFile) for inFile in inFiles))   # a file given twice is coded once
+    bases = defaultdict(list)
+    for inFile in inFiles:
+        bases[outputBase(inFile)].append(inFile)
+    clashes = [names for names in bases.values() if len(names) > 1]
+    for names in clashes:
+        print(f"ERROR: the outputs of {', '.join(names)} have the same name in {args.out_file}")
+    if clashes:
+        print("Rename the input files or code them in separate batches.")
+        exit(1)
+    os.makedirs(args.out_file, exist_ok=True)
+    jobs = [batchOutputs(inFile) for inFile in inFiles]
+    # option --manifest: skip the files whose outputs are up to date, record the others when they are coded
+    manifest = None
+    results = []
+    todo = jobs
+    if args.manifest != '':
+        manifest = readManifest()
+        results = [(job, manifest['files'][job[0]]['graphs'], manifest['files'][job[0]]['html'], None, None)
+                   for job in jobs if upToDate(manifest, job)]
+        skipped = set(result[0] for result in results)
+        todo = [job for job in jobs if job not in skipped]
+        print(f"Manifest {args.manifest}: {len(skipped)} file(s) up to date")
+    print(f"Batch: coding {len(todo)} file(s) with {args.jobs} job(s)...")
+    if args.jobs > 1:
+        # spawn (not fork): each worker needs its own grew backend
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(args.jobs, initializer=initWorker, initargs=(args, requestDict, engineRules, ruleHashes, prefilterRules)) as pool:
+            for result in pool.imap_unordered(batchJob, todo, chunksize=1):
+                recordJob(manifest, result)
+                results.append(result)
+    else:
+        workerRequests = requestDict
+        for job in todo:
+            result = batchJob(job)
+            recordJob(manifest, result)
+            results.append(result)
+    order = {job: nr for nr, job in enumerate(jobs)}
+    results.sort(key=lambda result: order[result[0]])
+
+    # add HTML links in input order and merge the tables
+    failed = []
+    tableFiles = []
+    nrGraphs = 0
+    for job, graphs, htmlFile, error, jobProfile in results:
+        if jobProfile is not None:
+            mergeProfile(jobProfile)
+        if error is not None:
+            print(f"  ERROR in {job[0]}: {error}")
+            failed.append(job[0])
+            continue
+        nrGraphs += graphs
+        if htmlFile is not None and manifest is None:
+            addIndexLink(htmlFile)
+        if job[2] != '':
+            tableFiles.append(job[2])
+    if manifest is not None:
+        writeManifest(manifest)
+        if args.html:
+            writeIndex(manifest)
+    if args.table != '':   # -t: merged table, with the header of the first file only
+        print(f"Merging {len(tableFiles)} coding table(s) to {args.table}")
+        mergeTables(tableFiles, args.table)
+    print(f"Batch finished: {len(results) - len(failed)} file(s), {nrGraphs} graphs, {len(failed)} error(s).")
+    return(len(failed))
+
+def serve (requestDict):
+    # option --serve: keep the grew backend and the request objects alive and code the files named on stdin
+    #   one input file per line, optionally followed by TAB and the output file (default: in directory out_file)
+    #   input files given as arguments are coded first
+    #   a status line is printed for each file: DONE<TAB>input<TAB>output<TAB>graphs or ERROR<TAB>input<TAB>message
+    #   the request file is read again if it was modified
+    #   -t: the tables of the coded files are merged at EOF
+    global workerRequests, searchPool
+    workerRequests = requestDict
+    requestTime = os.path.getmtime(args.request)
+    coded = {}  # output name (see outputBase) -> input file (real path) coded in this session
+    tableFiles = []  # per-file tables of this session, in the order in which they were coded
+    os.makedirs(args.out_file, exist_ok=True)
+    print("Serving: reading input file names from stdin (until EOF)...")
+    sys.stdout.flush()
+    for line in itertools.chain([inFile + '\n' for inFile in args.file_name], sys.stdin):
+        fields = line.rstrip('\n').split('\t')
+        if fields[0].strip() == '':
+            continue
+        if os.path.getmtime(args.request) != requestTime:
+            requestTime = os.path.getmtime(args.request)
+            patterns, without, workerRequests = readRequests()
+            if searchPool is not None:   # option --workers: the search workers were initialized with the old requests
+                searchPool.terminate()
+                searchPool = None
+        job = batchOutputs(fields[0].strip())
+        if len(fields) > 1 and fields[1].strip() != '':
+            job = (job[0], fields[1].strip(), job[2])
+        base = outputBase(job[0])
+        if not os.path.isfile(job[0]):
+            print(f"ERROR\t{job[0]}\tfile not found")
+        elif coded.setdefault(base, os.path.realpath(job[0])) != os.path.realpath(job[0]):
+            print(f"ERROR\t{job[0]}\toutputs would overwrite those of {coded[base]}")
+        else:
+            job, nrGraphs, htmlFile, error, jobProfile = batchJob(job)
+            if error is not None:
+                print(f"ERROR\t{job[0]}\t{error}")
+            else:
+                if htmlFile is not None:
+                    addIndexLink(htmlFile)
+                if job[2] != '' and not job[2] in tableFiles:
+                    tableFiles.append(job[2])
+                print(f"DONE\t{job[0]}\t{job[1]}\t{nrGraphs}")
+        sys.stdout.flush()
+    if args.table != '':   # -t: merged table, with the header of the first file only
+        print(f"Merging {len(tableFiles)} coding table(s) to {args.table}")
+        mergeTables(tableFiles, args.table)
+
+# -------------------------------------------------------
+# resumable batch runs (option --manifest)
+# -------------------------------------------------------
+'''
+The manifest (JSON) records for each coded input file its size, mtime and content hash, the hash of the request file,
+the version of the script, the options that change the outputs, and the output files.
+A file is coded again only if one of these has changed or an output is missing.
+The outputs are written to temporary files (.part-<name>), renamed when they are complete, so an interrupted run
+leaves the outputs of the previous run. The manifest is written every manifestInterval seconds and at the end.
+'''
+def partName (fileName):
+    # option --manifest: the temporary file for the output fileName (same directory and suffixes, see openFile)
+    if args.manifest == '':
+        return(fileName)
+    return(os.path.join(os.path.dirname(fileName), '.part-' + os.path.basename(fileName)))
+
+def commitPart (fileName):
+    # option --manifest: replace fileName with its complete temporary file
+    if partName(fileName) != fileName:
+        os.replace(partName(fileName), fileName)
+
+def readManifest ():
+    # the manifest of the earlier runs (or a new one) and the signature of this run
+    #   files: input file -> size, mtime, hash, requests, version, options, outputs, html, graphs, date
+    manifest = {'files': {}}
+    if os.path.isfile(args.manifest):
+        with open(args.manifest, 'r') as input:
+            manifest = json.load(input)
+    manifest['run'] = {
+        'requests': fileHash(args.request),
+        'version': __version__,
+        'options': {option: getattr(args, option) for option in manifestOptions},
+        }
+    return(manifest)
+
+def upToDate (manifest, job):
+    # True if the outputs of job were made from the same input, request file, version and options
+    #   the content hash of the input is only computed if its size or mtime has changed
+    inFile, outFile, tableFile = job
+    entry = manifest['files'].get(inFile)
+    if entry is None or any(entry.get(key) != manifest['run'][key] for key in manifest['run']):
+        return(False)
+    if entry['outputs'] != [outFile, tableFile] or not all(os.path.isfile(name) for name in entry['outputs'] if name != ''):
+        return(False)
+    if entry['html'] is not None and not os.path.isfile(htmlDir + '/' + entry['html']):
+        return(False)
+    stat = os.stat(inFile)
+    if [stat.st_size, stat.st_mtime] == [entry['size'], entry['mtime']]:
+        return(True)
+    if stat.st_size == entry['size'] and fileHash(inFile) == entry['hash']:   # touched, not modified
+        entry['mtime'] = stat.st_mtime
+        return(True)
+    return(False)
+
+def recordJob (manifest, result):
+    # record a coded file (result of batchJob) in the manifest, failed files are removed
+    if manifest is None:
+        return
+    job, nrGraphs, htmlFile, error, jobProfile = result
+    if error is not None:
+        manifest['files'].pop(job[0], None)
+        return
+    stat = os.stat(job[0])
+    entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': fileHash(job[0])}
+    entry.update(manifest['run'])
+    entry.update({'outputs': [job[1], job[2]], 'html': htmlFile, 'graphs': nrGraphs,
+                  'date': datetime.datetime.now().isoformat(timespec='seconds')})
+    manifest['files'][job[0]] = entry
+    if time.time() - manifestSaved >= manifestInterval:
+        writeManifest(manifest)
+
+def writeManifest (manifest):
+    # checkpoint: write the manifest to a temporary file and rename it
+    global manifestSaved
+    with open(partName(args.manifest), 'w') as out:
+        json.dump(manifest, out, ensure_ascii=False, indent=1)
+    commitPart(args.manifest)
+    manifestSaved = time.time()
+
+def writeIndex (manifest):
+    # write index.html with a link to the HTML file of each input of the manifest (see addIndexLink)
+    os.makedirs(htmlDir, exist_ok=True)
+    with open(partName(htmlDir + '/index.html'), 'w') as file:
+        file.write(htmlHead + '\n\n')
+        file.write(htmlSource + '\n\n<br/>')
+        for inFile in sorted(manifest['files']):
+            htmlFile = manifest['files'][inFile]['html']
+            if htmlFile is not None:
+                file.write('<br/>\n<a href="%s">%s</a>' % (htmlFile, htmlFile))
+    commitPart(htmlDir + '/index.html')
+
 # -------------------------------------------------------
 # main
 # -------------------------------------------------------
 def main (args):
-    global wholeCorpus
 
     # compare two coding tables, then exit
     if args.compare_table != '':   # -c
-        with open(args.file_name, 'r') as input:
-            table1 = pd.read_csv(input, delimiter='\t')
+        global pd
+        import pandas as pd
+        if args.compare_partitions > 0:   # tables larger than memory
+            compareTableStream(args.file_name, args.compare_table, args.out_file)
+            exit(0)
+        with openFile(args.file_name, 'r') as input:
+            table1 = pd.read_csv(input, delimiter='\t', dtype=str)
             input.close()
-        with open(args.compare_table, 'r') as input:
-            table2 = pd.read_csv(input, delimiter='\t')
+        with openFile(args.compare_table, 'r') as input:
+            table2 = pd.read_csv(input, delimiter='\t', dtype=str)
             input.close()
         merged = compareTable(table1, table2)
         print(f"Writing merged table to file {args.out_file}")
-        merged.to_csv(args.out_file, sep='\t', index=False)
+        with openFile(args.out_file, 'w', newline='') as output:
+            merged.to_csv(output, sep='\t', index=False)
         exit(0)
 
     # regular call for CoNLL-U input
-    try:
-        with open(args.file_name, 'r') as input:
-            data = input.read()
-    except FileNotFoundError:
+    if not (args.batch or args.serve) and not os.path.isfile(args.file_name):
         print("file not found", args.file_name)
         quit()
+    importGrew()
+
+    # option --profile: record phase and rule timings
+    global profile
+    if args.profile != '':
+        profile = newProfile()
 
     # read requests from tsv file
     if args.request != '':   # -r
+        start = time.perf_counter()
         patterns, without, requestDict = readRequests()
+        profilePhase('read_requests', start)
     else:
-        print(f"A file with grew requests is required (option -r)")
+        print("A file with grew requests is required (option -r)")
         exit(1)
 
-    # option -C: verify or add sent_id to graph meta data
-    originalCorpus = Corpus(data)
-    if args.check_ids:
-        print(f"Verifying sent_id in the corpus...")
-        originalCorpus, corrected = checkIDs(originalCorpus)
-        tmpFile = 'tmp_' + re.sub(r'.*/', '', args.file_name)
-        print(f"Writing the corpus with corrected IDs to temp file: {tmpFile}")
-        with open(tmpFile, 'w') as out:
-            for graph in originalCorpus:
-                out.write(originalCorpus[graph].to_conll() + '\n')
-            out.close()
-        print(f"  Re-importing the corpus from temp file: {tmpFile}")
-        with open(tmpFile, 'r') as input:
-            data = input.read()
-            input.close()
-    # re-read the data into a global CorpusDraft object (= a modifiable dictionary)
-    print(f"Creating grewpy CorpusDraft...")
-    wholeCorpus = CorpusDraft(data)
-    # a Corpus object that can be searched using .search()
-    print(f"Processing rules...")
-    codedCorpus = processRules(Corpus(originalCorpus.to_conll()), requestDict)
-
-    # output corpus as CoNLL-U        
-    print(f"Writing the output to {args.out_file}...\n", end='')
-    sorted_keys = sorted(codedCorpus.keys(), key=lambda x: int(x))
-    codedCONLLU = []  # store coded conllu for HTML export
-    with open(args.out_file, 'w') as out:
-        for key in sorted_keys:
-            conll = codedCorpus[key].to_conll()
-            out.write(conll + '\n')
-            codedCONLLU.append(conll)
-    print(f"Codings written for {len(sorted_keys)} graphs.")
-
-    # Function to redirect stdout to a string buffer
-    def redirect_stdout_to_buffer():
-        sys.stdout = StringIO()
-
-    # Function to restore stdout
-    def restore_stdout():
-        sys.stdout = sys.__stdout__
-
-    # convert the tree to HTML and add dependencies
-    def tree_to_html(tree_str, xpos, deps):
-        lines = tree_str.strip().split("\n") # Split the tree string into lines
-        # sort lines based on word numbers (print_tree orders according to hierarchy, e.g. root in first line etc)
-        lines = sorted(lines, key=lambda line: int(re.search(r'\[(\d+)\]', line).group(1)))
-        # Convert each line to HTML node with proper indentation using dots
-        html_nodes = []
-
-        def repl(match):  # returns string for re.sub below
-            wID = int(match.group(1))  # Evaluate the variable or expression
-            return f"xpos:{xpos.get(wID, '')} [{wID}:{deps.get(wID, '')}]"  # return id:head, e.g.  [5:6]
-
-        for line in lines:
-            wID = re.search(r'\[(\d+)\]', line).group(1)
-            wID = int(wID)
-            line = re.sub(r'\[(\d+)\]', repl, line)
-            leading_spaces = len(line) - len(line.lstrip(' ')) # Count the number of leading spaces
-            indented_line = '.' * leading_spaces + line.lstrip() # Replace leading spaces with dots
-            # Convert indented line to HTML node
-            html_nodes.append("{}".format(indented_line))
-        html_branch = "{}<br/>".format("".join(html_nodes)) # format HTML nodes
-        html_tree = "{}".format(html_branch) # format the entire HTML branch
-
-        """
-        change tree format and insert html codes. Tree looks like this:
-        (deprel:root) form:souhaite lemma:souhaiter upos:VERB [3:0]
-            (deprel:cc) form:et lemma:et upos:CCONJ [1:3]
-        """
-        html_tree = re.sub(
-            r'(\.+)?\(deprel:(.*?)\)(.*?)\[(\d+):(\d+)\]',
-            lambda m: f"{int(m.group(4)):02d}{'' if m.group(1) is None else m.group(1)}{m.group(3)} <span class=d>{m.group(2)}</span>&#8594;{m.group(5)}<br/>\n",
-            html_tree
-        )
-        html_tree = re.sub(r'lemma:(.*?) ', r'<span class=l>\1</span> ', html_tree)
-        html_tree = re.sub(r'upos:(VER[A-Z]+) ', r'<span class=v>\1</span> ' , html_tree)
-        html_tree = re.sub(r'upos:(.*?) ', r'<span class=u>\1</span> ', html_tree)
-        html_tree = re.sub(r'xpos:(.*?) ', r'<span class=x>\1</span> ', html_tree)
-        html_tree = re.sub(r'form:(.*?) ', r'<b>\1</b> ', html_tree)
-        html_tree = re.sub(r'(\.\.+)', r'<span class=dot>\1</span> ', html_tree)
-
-        return html_tree
-
-
-    # create a HTML version of the output
-    if args.html:
-        # make dir for HTML files
-        os.makedirs(htmlDir, exist_ok=True)
-        if not os.path.isdir(htmlDir):
-            print("Directory '%s' created\n" % htmlDir)
-
-        textCode = htmlFile = re.sub(r'.*/', '', args.out_file)
-        textCode = re.sub(r'.*/', '', textCode)  # strip path
-        textCode = re.sub(r'\..*', '', textCode)  # strip suffix
-        htmlFile = re.sub('conllu', 'html', htmlFile)
-        print(f"Writing HTML output to {htmlFile}...")
-        sentences = parse('\n'.join(codedCONLLU))
-        trees = parse_tree('\n'.join(codedCONLLU))
-        tree_strings = []     
-        
-        #  create index.html unless it exists
-        if not os.path.isfile(htmlDir+'/index.html'):
-            with open(htmlDir+'/index.html', 'w') as file:
-                file.write(htmlHead + '\n\n')
-                file.write(htmlSource + '\n\n<br/>')
-        # add link to this file
-        with open(htmlDir+'/index.html', 'a') as file:
-            file.write('<br/>\n<a href="%s">%s</a>' % (htmlFile, htmlFile))  # add link to index file            
-        """
-        Using the conllu module, we loop through the sentences and the print_tree representations
-        Since print_tree goes to stdout, we capture the output as string, then convert the string to HTML
-        """
-        with open(htmlDir + '/' + htmlFile, 'w') as out:
-            anchorList = [] # store anchors for index.html
-            out.write(htmlHead % textCode + '\n\n')
-            for s in range(len(sentences)):   # loop through sentences in file (TokenList objects)
-                # retrieve metadata entries
-                metadata = sentences[s].metadata
-                sCode = metadata['sent_id']
-                bib = ''  # add metadata to the output
-                if 'author' in metadata:
-                    bib = "{}{}:".format(bib, metadata["author"])
-                if 'title' in metadata:
-                    bib = "{} <i>{}</i>".format(bib, metadata["title"])
-                if 'date' in metadata:
-                    bib = "{} ({})".format(bib, metadata["date"])
-                if bib != '':
-                    bib = "{}<br/>\n".format(bib)
-                # add coding metadata: Iterate over metadata dict
-                coding_lines = []
-                for key, value in metadata.items():
-                    if key.startswith('coding_'):
-                        nr = re.sub(r'coding_', '', key)
-                        value = re.sub(r'(lemma|upos|xpos)=.*?;', r'', value)
-                        value = re.sub(r'textform=(.*?);', r'<b>\1</b>: ', value)
-                        value = re.sub(r';', r'; ', value)
-                        value = re.sub(r' (.*?)=', r' <span class=a>\1</span>=', value)
-                        coding_lines.append(nr + ': ' + value)
-                # sort lines numerically by coding numbers (coding_9 etc) and join
-                coding_lines = sorted(coding_lines, key=lambda x: int(x.split(':')[0]))
-                print_codings = '<br/>\n'.join(coding_lines)
-
-                clean = []
-                xpos = {}  # store xpos (the original Frantext pos tag in col 5)
-                deps = {}  # store id-head relations
-                for w in range(len(sentences[s])):  # loop through words in sentence
-                    token = sentences[s][w]
-                    id = token["id"]
-                    deps[id] = token["head"]  # store head node in a dict
-                    xpos[id] = token["xpos"]  # store xpos in a dict
-                    if re.search(r'^V', token["xpos"]):  # highlight verbs
-                        clean.append('<span class=v>' + token["form"] + '</span>')
-                    else:
-                        clean.append(token["form"])  # for printed plain text
-                sprint = " ".join(clean)  # the tokens
-                sprint = re.sub(r' ([,:;\.\!\?])', r'\1', sprint)
-                sprint = re.sub('\' ', '\'', sprint)
-                redirect_stdout_to_buffer()
-                trees[s].print_tree()  # get the root of the tree with the same index as the sentence
-                tree_str = sys.stdout.getvalue()  # make a list of print_tree objects
-                restore_stdout()
-                tree_strings.append(tree_str)
-                sparsed = tree_to_html(tree_str, xpos, deps)  # convert the tree to HTML and add dependencies
-
-                # print HTML
-                printOutput = '\n<a name=\"%s\"></a><hr>\n<h3>%s</h3>\n<font color="Sienna">%s</font>\n%s\n\n<p class="coding">%s</p>\n\n<p><div class=\"parse\"><p>%s</em></p></div>\n' % (sCode, sCode, bib, sprint, print_codings, sparsed)
-                out.write(printOutput)
-
-            out.write(htmlFoot + '\n')
-
-
-    # output coding table as tsv
-    outputAll = []
-    for key in sorted_keys:
-        outputAll.append(codedCorpus[key])
+    # option --serve: code the files named on stdin
+    if args.serve:
+        serve(requestDict)
+        if profile is not None:
+            writeProfile(requestDict)
+        exit(0)
+
+    # option --batch: many files, one output directory
+    if args.batch:
+        failed = codeBatch(requestDict)
+        if profile is not None:
+            writeProfile(requestDict)
+        if args.html:
+            print("New HTML files were createed. Don't forget to update them on your server.")
+        exit(1 if failed else 0)
+
+    nrGraphs, htmlFile = codeFile(args.file_name, args.out_file, args.table, requestDict)
+    if htmlFile is not None:
+        addIndexLink(htmlFile)
+    if profile is not None:
+        writeProfile(requestDict)
     if args.table != '':   # -t
-        writeTable(outputAll)
         print("To concatenate several coding table files preserving only the column header:\n%s" % "  > awk 'FNR==1 && NR!=1 {next} {print}' coded/*.csv > all.csv")
     if args.html:
         print("New HTML files were createed. Don't forget to update them on your server.")
@@ -565,7 +2782,8 @@ def main (args):
 #-------------------------------------------------------
 # parse arguments
 #-------------------------------------------------------
-if __name__ == "__main__":
+def argumentParser ():
+    # the command line options (also used by ud-bench.py)
     parser = argparse.ArgumentParser(
        description='''
 In a CoNLL-U file, the script produces coding strings with attribute-value pairs for structural properties.
@@ -575,11 +2793,23 @@ Coding strings are saved in CoNLL-U metadata format.
 
 ''', formatter_class = argparse.RawTextHelpFormatter   # allows triple quoting for multiple-line text
        )
-    parser.add_argument('file_name', type=str, help = "input data, a CoNLL-U file")
-    parser.add_argument('out_file', type=str,  help='output = CoNLL-U with added coding strings')
+    parser.add_argument('file_name', type=str, nargs='*', help = "input data, a CoNLL-U file\n  --batch: several files and/or directories\n  --serve: optional, coded before reading stdin")
+    parser.add_argument('out_file', type=str,  help='output = CoNLL-U with added coding strings\n  --batch, --serve: output directory')
     parser.add_argument(
        '-c', '--compare_table', default = "", type = str,
        help='compare this CorpusSearch coding table with the input file (UD codings)')
+    parser.add_argument(
+       '--compare_columns', default = 'clause,subj,dobj,iobj', type = str,
+       help='-c: comma-separated list of the compared columns (default clause,subj,dobj,iobj)')
+    parser.add_argument(
+       '--compare_key', default = 'textid,textform:textid,form', type = str,
+       help='-c: columns of the join key in the UD table and the CorpusSearch table, separated by \':\'\n  (default textid,textform:textid,form)\n  rows with the same key are joined in order of occurrence')
+    parser.add_argument(
+       '--compare_scores', default = "", type = str,
+       help='-c: write precision, recall and F1 of each attribute value to this tsv file')
+    parser.add_argument(
+       '--compare_partitions', default = 0, type = int,
+       help='-c: compare tables larger than memory: hash-partition both tables on the join key into N temporary files\n  and join them partition by partition (default 0 = in memory)\n  the rows of the merged table are in partition order')
     parser.add_argument(
         '-f', '--first_rule', action='store_true',
         help='if the first rule for an attribute matches, discard following rules)')
@@ -595,6 +2825,9 @@ Coding strings are saved in CoNLL-U metadata format.
     parser.add_argument(
        '--table_empty_string', default = "_", type = str,
        help='fill empty columns with this string')
+    parser.add_argument(
+       '--table_format', default = 'auto', choices = ['auto', 'tsv', 'parquet', 'feather'],
+       help='format of the coding table (default auto: from the suffix .parquet, .feather/.arrow, otherwise tsv)\n  parquet and feather require pyarrow')
     parser.add_argument(
        '--json', action='store_true',
        help='print graphs in JSON format instead of CoNLL -- NOT YET IMPLEMENTED')
@@ -607,5 +2840,76 @@ Coding strings are saved in CoNLL-U metadata format.
     parser.add_argument(
        '--html_file', default = None, type = str,
        help='special name for HTML file (default: file name = text_id)')
-    args = parser.parse_args()
-main(args)
+    parser.add_argument(
+       '--html_page_size', default = 0, type = int,
+       help='-H: split the HTML version into pages of N sentences (default 0 = one file)\n  also writes a JSON index (sent_id -> page, lemmas, codings) and a search page\n  table URLs point to the page of the sentence')
+    parser.add_argument(
+       '--chunk_size', default = 0, type = int,
+       help='stream the input and code it in chunks of N sentences (default 0 = whole file)\n  memory depends on N, not on corpus size')
+    parser.add_argument(
+       '-w', '--workers', default = 1, type = int,
+       help='search each chunk in N sentence shards with N worker processes (default 1)\n  ignored in --batch workers')
+    parser.add_argument(
+       '--split_rules', default = 1, type = int,
+       help='--workers: also split the rules into N groups (one task per shard and group)')
+    parser.add_argument(
+       '--async_output', action='store_true',
+       help='write CoNLL-U, HTML and table in background threads, overlapped with the coding of the next chunk')
+    parser.add_argument(
+       '--splice', action='store_true',
+       help='write the coded CoNLL-U as a copy of the input with the coding meta lines inserted\n  token lines are not rewritten: faster, and the formatting of the input is kept')
+    parser.add_argument(
+       '--compact', action='store_true',
+       help='keep the graphs in a compact array store instead of grew Graph objects (less memory, slower access)')
+    parser.add_argument(
+       '--sidecar', action='store_true',
+       help='keep the parsed input in a binary file <input>.udc, memory-mapped by later runs (rebuilt if the input changes)\n  only --engine index and the match cache avoid parsing with grew:\n  requests searched with grew on the whole corpus still make grew parse the file')
+    parser.add_argument(
+       '--prefilter', action='store_true',
+       help='search each request with grew only on the graphs with the literal feature values and relations of the pattern\n  (default: search all graphs)')
+    parser.add_argument(
+       '--cache', default = "", type = str,
+       help='SQLite file caching the matches of each rule and sentence\n  later runs only search new or modified rules and sentences')
+    parser.add_argument(
+       '--engine', default = 'grew', choices = ['grew', 'index'],
+       help='grew: search each request with grew (default)\nindex: evaluate the requests in a single pass over the graphs (falls back to grew for unsupported syntax)')
+    parser.add_argument(
+       '--profile', default = "", type = str,
+       help='write search time and matches of each rule and the time of each phase to this file\n  JSON, or TSV for file names *.tsv, *.csv')
+    parser.add_argument(
+       '--profile_summary', action='store_true',
+       help='--profile: also print phases and rules sorted by time to stderr')
+    parser.add_argument(
+       '-B', '--batch', action='store_true',
+       help='code several input files or directories (*.conllu), write the output to directory out_file\n  per-file tables go to out_file, -t is the merged table')
+    parser.add_argument(
+       '-j', '--jobs', default = 1, type = int,
+       help='--batch: number of worker processes (default 1)')
+    parser.add_argument(
+       '--manifest', default = "", type = str,
+       help='--batch: record the coded files in this JSON file (input hash, request file hash, version, options)\n  files with up-to-date outputs are skipped, outputs are renamed when complete\n  index.html is rewritten from the manifest')
+    parser.add_argument(
+       '--serve', action='store_true',
+       help='keep running and code the CoNLL-U files named on stdin (one per line), output to directory out_file\n  per-file tables go to out_file if -t is given')
+    return(parser)
+
+def run (argv=None, codingOnly=False):
+    # parse the command line and run main()
+    #   codingOnly: the lean entry point ud-code.py (without option -c)
+    global args
+    parser = argumentParser()
+    args = parser.parse_args(argv)
+    if codingOnly and args.compare_table != '':
+        parser.error('-c is not available in ud-code.py, use ud-coding.py')
+    if args.batch and args.serve:
+        parser.error('--batch and --serve cannot be combined')
+    if args.manifest != '' and not args.batch:
+        parser.error('--manifest requires --batch')
+    if not (args.batch or args.serve):
+        if len(args.file_name) != 1:
+            parser.error('only one input file allowed without --batch')
+        args.file_name = args.file_name[0]
+    main(args)
+
+if __name__ == "__main__":
+    run()